@@ -0,0 +1,331 @@
+#!/bin/python3
+"""
+Offline benchmarks for armorapi against the local mock API in mock_server.py, no credentials or network needed.
+
+Measures client start up time, requests/sec and p50/p99 latency for single thread, multithread, batch and async
+load, paging, streaming and export throughput, and behaviour under token expiry and 429 throttling.
+
+Usage: python benchmarks/bench.py [--requests 2000] [--threads 16] [--concurrency 64] [--memory] [--json out.json]
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import threading
+import tempfile
+import tracemalloc
+import subprocess
+import contextlib
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../src")
+import requests
+from armorapi import *
+
+MOCK_SERVER = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'mock_server.py')
+USERNAME = 'benchmark@example.com'
+PASSWORD = 'benchmark'
+
+
+class LocalAdapter(requests.adapters.HTTPAdapter):
+    """
+    sends requests for the whitelisted https domains to the mock server
+    """
+
+    def __init__(self, base_url, **kwargs):
+        self.base_url = base_url
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        parts = urlsplit(request.url)
+        request.url = self.base_url + parts.path + ('?' + parts.query if parts.query else '')
+        return super().send(request, **kwargs)
+
+
+def local_session(base_url, pool_maxsize=32):
+    session = requests.Session()
+    session.mount('https://', LocalAdapter(base_url, pool_maxsize=pool_maxsize))
+    return session
+
+
+def local_aiohttp_session(base_url, limit=100):
+    import aiohttp
+    import yarl
+    base = yarl.URL(base_url)
+
+    class LocalRequest(aiohttp.ClientRequest):
+        def __init__(self, method, url, *args, **kwargs):
+            super().__init__(method, base.with_path(url.path).with_query(url.query), *args, **kwargs)
+
+    return aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=limit), request_class=LocalRequest)
+
+
+@contextlib.contextmanager
+def mock_server(**config):
+    """
+    runs the mock API in a subprocess, so the server doesn't compete with the client for the GIL
+    """
+    command = [sys.executable, MOCK_SERVER, '--port', '0']
+    for key, value in config.items():
+        command += ['--%s' % key.replace('_', '-'), str(value)]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, universal_newlines=True)
+    try:
+        port = int(process.stdout.readline().split()[-1])
+        yield 'http://127.0.0.1:%s' % port
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def admin(base_url, action, payload=None):
+    requests.post('%s/_mock/%s' % (base_url, action), json=payload or {}).raise_for_status()
+
+
+def percentile(samples, q):
+    if not samples:
+        return 0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Result:
+    def __init__(self, name, count, elapsed, latencies, errors=0, unit='req', notes=''):
+        self.name = name
+        self.count = count
+        self.elapsed = elapsed
+        self.latencies = latencies
+        self.errors = errors
+        self.unit = unit
+        self.notes = notes
+        self.peak_memory = None
+
+    def as_dict(self):
+        return {'name': self.name, 'count': self.count, 'unit': self.unit, 'seconds': self.elapsed,
+                'per_second': self.count / self.elapsed if self.elapsed else 0,
+                'p50_ms': percentile(self.latencies, 0.5) * 1000, 'p99_ms': percentile(self.latencies, 0.99) * 1000,
+                'errors': self.errors, 'peak_memory_mb': self.peak_memory, 'notes': self.notes}
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+def client(base_url, **kwargs):
+    return ArmorApi(USERNAME, PASSWORD, session=local_session(base_url), **kwargs)
+
+
+def bench_startup(base_url, args, auth, token_cache=None):
+    latencies = [timed(lambda: client(base_url, auth=auth, token_cache=token_cache)) for _ in range(args.startups)]
+    name = 'startup v%s%s' % (auth, ' token cache' if token_cache else '')
+    return Result(name, len(latencies), sum(latencies), latencies, unit='client')
+
+
+def bench_sequential(base_url, args):
+    api = client(base_url)
+    start = time.perf_counter()
+    latencies = [timed(api.make_request, 'https://api.armor.com/vms/%s' % index) for index in range(args.requests)]
+    return Result('single thread', args.requests, time.perf_counter() - start, latencies)
+
+
+def bench_threaded(base_url, args, name='multithread', url='https://api.armor.com/vms/%s', api=None):
+    api = api or client(base_url)
+    errors = []
+
+    def run(index):
+        try:
+            return timed(api.make_request, url % index)
+        except requests.exceptions.RequestException as error:
+            errors.append(error)
+            return None
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        latencies = [latency for latency in executor.map(run, range(args.requests)) if latency is not None]
+    return Result(name, args.requests, time.perf_counter() - start, latencies, len(errors), notes='%s threads' % args.threads)
+
+
+def bench_batch(base_url, args):
+    api = client(base_url)
+    batch = ['https://api.armor.com/vms/%s' % index for index in range(args.requests)]
+    start = time.perf_counter()
+    results = api.make_requests(batch, max_workers=args.threads, default_domain_limit=args.threads)
+    elapsed = time.perf_counter() - start
+    errors = sum(result.error is not None for result in results)
+    return Result('make_requests', args.requests, elapsed, [], errors, notes='%s workers, no per request latency' % args.threads)
+
+
+def bench_async(base_url, args):
+    async def run():
+        session = local_aiohttp_session(base_url, args.concurrency)
+        semaphore = asyncio.Semaphore(args.concurrency)
+        latencies = []
+
+        async def request(api, index):
+            async with semaphore:
+                start = time.perf_counter()
+                await api.make_request('https://api.armor.com/vms/%s' % index)
+                latencies.append(time.perf_counter() - start)
+
+        try:
+            async with AsyncArmorApi(USERNAME, PASSWORD, session=session) as api:
+                start = time.perf_counter()
+                await asyncio.gather(*[request(api, index) for index in range(args.requests)])
+                elapsed = time.perf_counter() - start
+        finally:
+            await session.close()
+        return Result('async', args.requests, elapsed, latencies, notes='%s in flight' % args.concurrency)
+
+    try:
+        import aiohttp
+    except ImportError:
+        return None
+    return asyncio.run(run())
+
+
+def bench_paged(base_url, args, prefetch):
+    api = client(base_url)
+    latencies = []
+    start = time.perf_counter()
+    previous = start
+    count = 0
+    for count, item in enumerate(api.iter_items('https://api.armor.com/vms', page_size=args.page_size, prefetch=prefetch), 1):
+        if count % args.page_size == 0:
+            now = time.perf_counter()
+            latencies.append(now - previous)
+            previous = now
+    return Result('iter_items prefetch=%s' % prefetch, count, time.perf_counter() - start, latencies, unit='item',
+                  notes='page size %s, latency per page' % args.page_size)
+
+
+def bench_stream(base_url, args):
+    api = client(base_url)
+    start = time.perf_counter()
+    count = sum(1 for _ in api.stream_records('https://api.armor.com/vms'))
+    return Result('stream_records', count, time.perf_counter() - start, [], unit='item', notes='single unpaged response')
+
+
+def bench_export(base_url, args, compression):
+    api = client(base_url)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'export.ndjson')
+        start = time.perf_counter()
+        count = api.export('https://api.armor.com/vms', path, page_size=args.page_size, compression=compression)
+        elapsed = time.perf_counter() - start
+        size = os.path.getsize(path)
+    return Result('export %s' % (compression or 'ndjson'), count, elapsed, [], unit='item',
+                  notes='page size %s, %.1f MB written' % (args.page_size, size / 2 ** 20))
+
+
+def bench_token_expiry(base_url, args):
+    """
+    threaded load while every token is revoked at intervals, exercising single flight reauthentication
+    """
+    metrics = MetricsCollector()
+    api = client(base_url, retries401=100, instrumentation=Instrumentation(collectors=[metrics]))
+    stop = threading.Event()
+
+    def expire():
+        while not stop.wait(args.expire_interval):
+            admin(base_url, 'expire-tokens')
+
+    expirer = threading.Thread(target=expire, daemon=True)
+    expirer.start()
+    try:
+        result = bench_threaded(base_url, args, name='multithread token expiry', api=api)
+    finally:
+        stop.set()
+        expirer.join()
+    result.notes += ', %s reauthentications' % metrics.reauthentications['allowed']
+    return result
+
+
+def bench_throttled(base_url, args):
+    """
+    threaded load against a server that throttles beyond args.rate requests per second, paced by the scheduler
+    """
+    metrics = MetricsCollector()
+    api = client(base_url, instrumentation=Instrumentation(collectors=[metrics]),
+                 scheduler=RequestScheduler(rate=args.rate, max_retries=10))
+    admin(base_url, 'config', {'rate': args.rate})
+    try:
+        result = bench_threaded(base_url, args, name='throttled %s/s' % args.rate, api=api)
+    finally:
+        admin(base_url, 'config', {'rate': 0})
+    result.notes += ', %s retries' % sum(metrics.retries.values())
+    return result
+
+
+def scenarios(base_url, args):
+    token_cache = MemoryTokenCache()
+    client(base_url, token_cache=token_cache)
+    return [
+        ('startup_v1', lambda: bench_startup(base_url, args, 1)),
+        ('startup_v2', lambda: bench_startup(base_url, args, 2)),
+        ('startup_cached', lambda: bench_startup(base_url, args, 1, token_cache)),
+        ('sequential', lambda: bench_sequential(base_url, args)),
+        ('threaded', lambda: bench_threaded(base_url, args)),
+        ('batch', lambda: bench_batch(base_url, args)),
+        ('async', lambda: bench_async(base_url, args)),
+        ('paged', lambda: bench_paged(base_url, args, 0)),
+        ('paged_prefetch', lambda: bench_paged(base_url, args, 2)),
+        ('stream', lambda: bench_stream(base_url, args)),
+        ('export', lambda: bench_export(base_url, args, None)),
+        ('export_gzip', lambda: bench_export(base_url, args, 'gzip')),
+        ('token_expiry', lambda: bench_token_expiry(base_url, args)),
+        ('throttled', lambda: bench_throttled(base_url, args)),
+    ]
+
+
+def print_results(results):
+    print('%-28s %8s %12s %9s %9s %9s  %s' % ('scenario', 'count', 'per second', 'p50 ms', 'p99 ms', 'peak MB', 'notes'))
+    for result in results:
+        row = result.as_dict()
+        peak = '%.1f' % row['peak_memory_mb'] if row['peak_memory_mb'] is not None else '-'
+        notes = row['notes'] + (', %s errors' % row['errors'] if row['errors'] else '')
+        print('%-28s %8s %8.0f/%-4s %9.2f %9.2f %9s  %s' % (row['name'], row['count'], row['per_second'], row['unit'],
+                                                          row['p50_ms'], row['p99_ms'], peak, notes))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Offline armorapi benchmarks against a local mock Armor API')
+    parser.add_argument('--requests', type=int, default=2000, help='requests per load scenario')
+    parser.add_argument('--threads', type=int, default=16, help='threads for multithread scenarios')
+    parser.add_argument('--concurrency', type=int, default=64, help='requests in flight for the async scenario')
+    parser.add_argument('--startups', type=int, default=20, help='clients created per start up scenario')
+    parser.add_argument('--items', type=int, default=20000, help='items served by the paged endpoint')
+    parser.add_argument('--page-size', type=int, default=500)
+    parser.add_argument('--expire-interval', type=float, default=0.5, help='seconds between token revocations')
+    parser.add_argument('--rate', type=float, default=200, help='server side request rate limit for the throttled scenario')
+    parser.add_argument('--only', action='append', help='run only the named scenario, may be repeated')
+    parser.add_argument('--memory', action='store_true', help='rerun each scenario under tracemalloc to report peak memory')
+    parser.add_argument('--json', help='also write results to this file')
+    args = parser.parse_args(argv)
+
+    results = []
+    with mock_server(items=args.items) as base_url:
+        for name, scenario in scenarios(base_url, args):
+            if args.only and name not in args.only:
+                continue
+            result = scenario()
+            if result is None:
+                print('skipping %s, dependency not installed' % name)
+                continue
+            if args.memory:
+                tracemalloc.start()
+                scenario()
+                result.peak_memory = tracemalloc.get_traced_memory()[1] / 2 ** 20
+                tracemalloc.stop()
+            results.append(result)
+
+    print_results(results)
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump([result.as_dict() for result in results], json_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+#!/bin/python3
+"""
+Micro-benchmark of the per call overhead armorapi adds to a request.
+
+Requests are answered in process by a session that never touches the network, so the timings are the cost of
+make_request itself (url validation, header handling, body serialisation, logging, scheduling and instrumentation)
+on top of the session call, which is measured on its own as the baseline.
+
+Usage: python benchmarks/bench_overhead.py [--calls 20000]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from urllib.parse import urlsplit
+sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../src")
+import requests
+from armorapi import *
+
+_responses = {
+    '/auth/authorize': b'{"code": "code"}',
+    '/auth/token': b'{"access_token": "token"}',
+    '/me': b'{"accounts": [{"id": 1000}]}',
+}
+
+
+class NullSession(requests.Session):
+    """
+    session answering every request in process with a canned json response, without going through the requests
+    adapter machinery, so make_request timings are dominated by armorapi itself
+    """
+
+    def request(self, method, url, **kwargs):
+        response = requests.Response()
+        response.status_code = 200
+        response.url = url
+        response.headers['Content-Type'] = 'application/json'
+        response._content = _responses.get(urlsplit(url).path, b'{}')
+        return response
+
+
+def per_call(function, calls):
+    """
+    best of 5 runs, in microseconds per call
+    """
+    best = None
+    for _ in range(5):
+        start = time.perf_counter()
+        for _ in range(calls):
+            function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / calls * 1e6
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Per call overhead of ArmorApi.make_request')
+    parser.add_argument('--calls', type=int, default=20000)
+    args = parser.parse_args(argv)
+
+    api = ArmorApi('benchmark@example.com', 'benchmark', session=NullSession())
+    url = 'https://api.armor.com/vms/1234'
+    payload = {'name': 'vm', 'tags': ['a', 'b'], 'settings': {'enabled': True}}
+    serialised = json.dumps(payload).encode()
+
+    baseline = per_call(lambda: api.session.request('GET', url, data=None, headers={}, stream=False), args.calls)
+    cases = [
+        ('session.request GET (baseline)', baseline),
+        ('make_request GET', per_call(lambda: api.make_request(url), args.calls)),
+        ('make_request POST dict', per_call(lambda: api.make_request(url, 'post', payload), args.calls)),
+        ('make_request POST bytes', per_call(lambda: api.make_request(url, 'post', serialised), args.calls)),
+        ('_validate_url', per_call(lambda: api._validate_url(url), args.calls)),
+    ]
+    print('%-34s %10s %14s' % ('case', 'us/call', 'over baseline'))
+    for name, microseconds in cases:
+        overhead = '' if name.startswith('session') or name.startswith('_') else '%+.1f' % (microseconds - baseline)
+        print('%-34s %10.1f %14s' % (name, microseconds, overhead))
+
+
+if __name__ == '__main__':
+    main()
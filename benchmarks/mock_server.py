@@ -0,0 +1,225 @@
+#!/bin/python3
+"""
+Local stand-in for the Armor API used by the benchmarks.
+
+Emulates v1 authentication (/auth/authorize, /auth/token, /auth/token/reissue), the v2 ADFS form post flow, /me,
+a paged list endpoint (/vms, paged with the Range header) and a generic json endpoint for any other path.
+Tokens expire after token_ttl seconds and requests beyond rate per second are throttled with 429 and Retry-After.
+
+Run standalone with: python mock_server.py --port 8080
+The server prints 'listening on <port>' once it accepts connections. Benchmarks change its behaviour at runtime
+through the /_mock/config and /_mock/expire-tokens endpoints.
+"""
+import re
+import sys
+import json
+import time
+import secrets
+import argparse
+import threading
+from urllib.parse import urlsplit, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+_range = re.compile(r'entities=(\d+)-(\d+)')
+
+
+class MockState:
+    """
+    tokens, throttling and counters shared by all request handler threads
+    """
+
+    def __init__(self, token_ttl=900, rate=0, latency=0, items=10000, accounts=3):
+        self.token_ttl = token_ttl
+        self.rate = rate
+        self.latency = latency
+        self.items = items
+        self.accounts = accounts
+        self.tokens = {}
+        self.counts = {}
+        self._allowance = rate
+        self._checked = time.monotonic()
+        self._lock = threading.Lock()
+
+    def configure(self, **config):
+        with self._lock:
+            for key, value in config.items():
+                if hasattr(self, key) and not key.startswith('_'):
+                    setattr(self, key, value)
+            self._allowance = self.rate
+
+    def issue_token(self):
+        token = secrets.token_hex(16)
+        with self._lock:
+            self.tokens[token] = time.monotonic() + self.token_ttl
+        return token
+
+    def valid_token(self, token):
+        with self._lock:
+            return self.tokens.get(token, 0) > time.monotonic()
+
+    def expire_tokens(self):
+        with self._lock:
+            self.tokens.clear()
+
+    def count(self, path):
+        with self._lock:
+            self.counts[path] = self.counts.get(path, 0) + 1
+
+    def throttled(self):
+        """
+        token bucket over all requests, returns True when the request should get a 429
+        """
+        if not self.rate:
+            return False
+        with self._lock:
+            now = time.monotonic()
+            self._allowance = min(self.rate, self._allowance + (now - self._checked) * self.rate)
+            self._checked = now
+            if self._allowance < 1:
+                return True
+            self._allowance -= 1
+            return False
+
+
+class MockArmorHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body=b'', headers=None, content_type='application/json'):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _json_body(self, body):
+        try:
+            return json.loads(body or b'{}')
+        except ValueError:
+            return {}
+
+    def _authorised(self):
+        token = self.headers.get('Authorization', '').split(' ', 1)[-1]
+        return self.state.valid_token(token)
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PUT(self):
+        self._handle('PUT')
+
+    def _handle(self, method):
+        path = urlsplit(self.path).path
+        body = self._body()
+        self.state.count(path)
+        if path.startswith('/_mock/'):
+            return self._admin(path, body)
+        if self.state.latency:
+            time.sleep(self.state.latency)
+        if self.state.throttled():
+            return self._send(429, {'message': 'Too many requests'}, {'Retry-After': '1'})
+
+        if method == 'POST' and path == '/auth/authorize':
+            return self._send(200, {'code': secrets.token_hex(8), 'success': True})
+        if method == 'POST' and path == '/auth/token':
+            return self._send(200, {'access_token': self.state.issue_token(), 'id_token': None})
+        if method == 'POST' and path == '/auth/token/reissue':
+            if not self.state.valid_token(self._json_body(body).get('token')):
+                return self._send(401, {'message': 'Invalid token'})
+            return self._send(200, {'access_token': self.state.issue_token(), 'id_token': None})
+        if method == 'POST' and path == '/adfs/oauth2/authorize':
+            return self._adfs(parse_qs(body.decode()))
+
+        if not self._authorised():
+            return self._send(401, {'message': 'Authorization has been denied for this request.'})
+        if path == '/me':
+            accounts = [{'id': 1000 + index, 'name': 'Account %s' % index, 'accountType': 'Direct'} for index in range(self.state.accounts)]
+            return self._send(200, {'accounts': accounts, 'user': {'id': 1}})
+        if path == '/vms':
+            return self._paged()
+        return self._send(200, {'path': path, 'method': method, 'account': self.headers.get('X-Account-Context')})
+
+    def _adfs(self, form):
+        auth_method = form.get('AuthMethod', [''])[0]
+        if auth_method == 'FormsAuthentication':
+            page = '<html><body><form method="post"><input id="context" type="hidden" name="Context" value="%s"/>' \
+                   '<input type="submit" value="Continue"/></form></body></html>' % secrets.token_hex(32)
+            return self._send(200, page.encode(), content_type='text/html')
+        if auth_method == 'AzureMfaServerAuthentication' and form.get('Context'):
+            page = '<html><body><form method="POST" name="hiddenform" action="https://amp.armor.com/">' \
+                   '<input type="hidden" name="id_token" value="%s" /></form></body></html>' % self.state.issue_token()
+            return self._send(200, page.encode(), content_type='text/html')
+        return self._send(400, b'<html><body>Bad request</body></html>', content_type='text/html')
+
+    def _paged(self):
+        total = self.state.items
+        first, last = 0, total - 1
+        match = _range.search(self.headers.get('Range', ''))
+        if match:
+            first, last = int(match.group(1)), min(int(match.group(2)), total - 1)
+        if first >= total:
+            return self._send(416, {'message': 'Requested range not satisfiable'}, {'Content-Range': 'entities */%s' % total})
+        items = [{'id': index, 'name': 'vm-%s' % index, 'status': 'Running', 'agent': {'version': '3.0.0', 'healthy': True}}
+                 for index in range(first, last + 1)]
+        return self._send(200, items, {'Content-Range': 'entities %s-%s/%s' % (first, last, total)})
+
+    def _admin(self, path, body):
+        if path == '/_mock/expire-tokens':
+            self.state.expire_tokens()
+        elif path == '/_mock/config':
+            self.state.configure(**self._json_body(body))
+        elif path == '/_mock/counts':
+            return self._send(200, self.state.counts)
+        return self._send(200, {'ok': True})
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # the default backlog of 5 drops connections under concurrent load, stalling clients on SYN retries
+    request_queue_size = 1024
+
+
+def make_server(host='127.0.0.1', port=0, **config):
+    """
+    returns a MockServer serving the mock API, port 0 picks a free port
+    """
+    handler = type('Handler', (MockArmorHandler,), {'state': MockState(**config)})
+    return MockServer((host, port), handler)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=0)
+    parser.add_argument('--token-ttl', type=float, default=900, help='seconds before issued tokens expire')
+    parser.add_argument('--rate', type=float, default=0, help='requests per second before 429s, 0 is unlimited')
+    parser.add_argument('--latency', type=float, default=0, help='seconds added to every API request')
+    parser.add_argument('--items', type=int, default=10000, help='number of items served by /vms')
+    parser.add_argument('--accounts', type=int, default=3, help='number of accounts returned by /me')
+    args = parser.parse_args(argv)
+    server = make_server(args.host, args.port, token_ttl=args.token_ttl, rate=args.rate, latency=args.latency,
+                         items=args.items, accounts=args.accounts)
+    print('listening on %s' % server.server_address[1], flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    sys.exit(main())
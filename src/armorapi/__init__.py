@@ -1,61 +1,73 @@
 #!/bin/python3
-import os
 import time
 import logging
 import threading
-import re
-import json
+import collections
+from concurrent.futures import ThreadPoolExecutor
 import requests
-from bs4 import BeautifulSoup
+from ._base import _ArmorApiBase
+from .asyncapi import AsyncArmorApi
+from .tokencache import TokenCache, MemoryTokenCache, FileTokenCache
+from .pagination import range_headers, parse_content_range, page_items
+from .jsonstream import iter_json_records
+from .responsecache import ResponseCache
+from .scheduler import RequestScheduler, TokenBucket, CircuitBreaker, CircuitOpenError
+from .accounts import AccountView
+from .metrics import Instrumentation, MetricsCollector, Histogram, RequestEvent, endpoint_label
+from .export import export_pages, export_signature
 
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.NullHandler())
 logger.setLevel(logging.DEBUG)
 
+BatchResult = collections.namedtuple('BatchResult', ['request', 'response', 'error'])
 
-class ArmorApi:
+
+class ArmorApi(_ArmorApiBase):
     """
     Rest API client for the Armor API, manages 0auth2 authentication.
     """
 
     def __init__(self,username,password,
-                 accountid=None, retries401=4, auth=1):
-        self.accountid = accountid
-        self._auth = auth
-        self.session = requests.session()
+                 accountid=None, retries401=4, auth=1, renew_interval=None, token_cache=None, pool_maxsize=10,
+                 response_cache=None, scheduler=None, instrumentation=None, session=None, adfs_parser='auto'):
+        super().__init__(username, password, accountid, retries401, auth, token_cache, adfs_parser)
+        self.session = session or requests.session()
         self.session.headers.update({'Accept': 'application/json', 'Content-Type': 'application/json'})
-        self._timer = time.time()
-        self._authorisation_token = ''
-        self._new_token = False
+        if session is None:
+            self.session.mount('https://', requests.adapters.HTTPAdapter(pool_maxsize=pool_maxsize))
+        self.response_cache = response_cache
+        self.scheduler = scheduler or RequestScheduler()
+        self.instrumentation = instrumentation or Instrumentation()
         self._token_lock = threading.Lock()
-        self._domain_whitelist = ['amp.armor.com', 'sts.armor.com', 'api.armor.com', 'api.accounts.armor.com', 'agent-management.api.armor.com', 'security-detections.api.secure-prod.services', 'compliance.api.secure-prod.services', 'api.logs.armor.com', 'api.notifications.armor.com', 'webhooks.api.secure-prod.services', 'logs.api.secure-prod.services']
+        self._auth_lock = threading.RLock()
+        self._renewal_thread = None
+        self._renewal_stop = threading.Event()
+        self._renewal_retry = 30
         logger.debug('initialising armor api')
-        
-        self._sanitise_creds(username,password)
-        self._sanitise_retries401(retries401)
-        self._authenticate()
 
-    def _sanitise_creds(self,username,password):
-        """
-        sanitises credentials before making them members
-        """
-        if len(password) > 512 or len(username) > 512:
-            logger.critical('username and/or password greater than 512 characters')
-            raise ValueError('username and/or password greater than 512 characters')
-        else:
-            self._username = username
-            self._password = password
+        if not self._load_cached_token():
+            self._authenticate()
+        if renew_interval:
+            self.start_token_renewal(renew_interval)
 
-    def _sanitise_retries401(self,retries401):
+    def _load_cached_token(self):
         """
-        sanitises retires401 input before making it a member
+        restores token, prefix and account context from the token cache, returns False if there's no usable entry
         """
-        if isinstance(retries401, int) and 1 <= retries401 <=100:
-            self._retries401 = retries401
-            self._count401 = self._retries401
-        else:
-            logger.critical('retries401 must be an integer between 1 and 100, the following was provided: %s' % retries401)
-            raise ValueError('retries401 must be an integer between 1 and 100, the following was provided: %s' % retries401)
+        entry = self._read_token_cache()
+        if entry is None:
+            return False
+        with self.instrumentation.timed_lock(self._token_lock, 'token'):
+            logger.debug('lock acquired to update _authorisation_token')
+            self._token_prefix = entry['prefix']
+            self._authorisation_token = entry['token']
+            self._new_token = True
+            self._token_generation += 1
+            self._token_issued = entry['issued']
+        self.session.headers.update({'X-Account-Context': '%s' % self._context_accountid})
+        self._update_authorisation_header()
+        return True
 
     def _authenticate(self):
         """
@@ -66,14 +78,16 @@ class ArmorApi:
         elif self._auth == 2:
             self._v2_authentication()
         else:
-            logger.critical('Invalid auth version provided: %s' % self._auth)
-            raise ValueError('Invalid auth version provided: %s' % self._auth)
+            self._invalid_auth_version()
 
     def _v1_authentication(self):
         self._token_prefix = 'FH-AUTH'
-        self._v1_get_authentication_token()
-        self._v1_get_authorisation_token()
-        self._test_request_and_accountid()
+        with self.instrumentation.timed_stage('v1_authorize'):
+            self._v1_get_authentication_token()
+        with self.instrumentation.timed_stage('v1_token'):
+            self._v1_get_authorisation_token()
+        with self.instrumentation.timed_stage('me'):
+            self._test_request_and_accountid()
 
     def _v1_get_authentication_token(self):
         """
@@ -83,8 +97,9 @@ class ArmorApi:
         logger.debug('Performing initial v1 authentication to get authentication token')
         payload = {'userName': self._username, 'password': self._password}
         response = self.make_request('https://api.armor.com/auth/authorize', method="post", data=payload)
-        logger.debug('API returned the following: %s' % response.json())
-        self.v1_authcode = response.json().get('code')
+        json_response = response.json()
+        logger.debug('API returned the following keys: %s', list(json_response))
+        self.v1_authcode = json_response.get('code')
 
     def _v1_get_authorisation_token(self):
         """
@@ -93,44 +108,54 @@ class ArmorApi:
         logger.debug('Performing 2nd stage v1 authentication, use authentication token to get authorisation token')
         payload = {'code': self.v1_authcode, 'grant_type': 'authorization_code'}
         response = self.make_request('https://api.armor.com/auth/token', method='post', data=payload)
-        logger.debug('API returned the following: %s' % response.json())
-        with self._token_lock:
+        json_response = response.json()
+        logger.debug('API returned the following keys: %s', list(json_response))
+        with self.instrumentation.timed_lock(self._token_lock, 'token'):
             logger.debug('lock acquired to update _authorisation_token')
-            self._authorisation_token = response.json().get('access_token')
+            self._authorisation_token = json_response.get('access_token')
             self._new_token = True
-        logger.debug('Authorisation token set to: %s ' % self._authorisation_token)
+            self._token_generation += 1
+            self._token_issued = time.time()
+        logger.debug('Authorisation token set')
 
     def v1_reissue_authorisation_token(self):
         """
-        v1 authorisation renew authorisation token
+        v1 authorisation renew authorisation token. A token that can no longer be reissued (e.g. it was revoked or
+        expired while the process was suspended) is replaced by a full authentication, as resending the reissue
+        request after a 401 reauthentication would still carry the rejected token
         """
         logger.debug('Renewing authorisation token (v1 auth)')
-        logger.debug('Authorisation token currently set to: %s ' % self._authorisation_token)
         payload = {'token': self._authorisation_token}
-        response = self.make_request('https://api.armor.com/auth/token/reissue', method='post', data=payload)
-        logger.debug('API returned the following: %s' % response.json())
-        with self._token_lock:
+        try:
+            response = self._make_request('https://api.armor.com/auth/token/reissue', 'post', payload, {}, False, reauthenticate=False)
+        except requests.exceptions.HTTPError as error:
+            if error.response is None or error.response.status_code != 401:
+                raise
+            logger.warning('Authorisation token can no longer be reissued, reauthenticating')
+            with self.instrumentation.timed_lock(self._auth_lock, 'auth'):
+                self._invalidate_token_cache()
+                self._authenticate()
+            return
+        json_response = response.json()
+        logger.debug('API returned the following keys: %s', list(json_response))
+        with self.instrumentation.timed_lock(self._token_lock, 'token'):
             logger.debug('lock acquired to update _authorisation_token')
-            self._authorisation_token = response.json().get('access_token')
+            self._authorisation_token = json_response.get('access_token')
             self._new_token = True
-        logger.debug('Authorisation token renewed to %s' % self._authorisation_token)
+            self._token_generation += 1
+            self._token_issued = time.time()
+        logger.debug('Authorisation token renewed')
+        self._write_token_cache()
 
     def _v2_authentication(self):
         self._token_prefix = 'Bearer'
         self._v2_set_bearer_request_url()
-        self._v2_get_authentication_token()
-        self._v2_get_authorisation_token()
-        self._test_request_and_accountid()
-
-    def _v2_set_bearer_request_url(self):
-        """
-        Sets the request url, including parameters for the bearer token request cycles
-        """
-        response_type = 'id_token'
-        response_mode = 'form_post'
-        client_id = 'b2264823-30a3-4706-bf48-4cf80dad76d3'
-        redirect_uri = 'https://amp.armor.com/'
-        self.bearer_request_url = 'https://sts.armor.com/adfs/oauth2/authorize?response_type=%s&response_mode=%s&client_id=%s&redirect_uri=%s' % (response_type, response_mode, client_id, redirect_uri)
+        with self.instrumentation.timed_stage('v2_forms_authentication'):
+            self._v2_get_authentication_token()
+        with self.instrumentation.timed_stage('v2_mfa_authentication'):
+            self._v2_get_authorisation_token()
+        with self.instrumentation.timed_stage('me'):
+            self._test_request_and_accountid()
 
     def _v2_get_authentication_token(self):
         """
@@ -140,8 +165,7 @@ class ArmorApi:
         logger.debug('Performing initial v2 authentication to get authentication token')
         payload = {'UserName': self._username, 'Password': self._password, 'AuthMethod': 'FormsAuthentication'}
         sso_auth_response = self.session.post(self.bearer_request_url, data=payload)
-        soup = BeautifulSoup(sso_auth_response.text, 'html.parser')
-        self.context_token = soup.find('input', {'id': 'context'})['value']
+        self.context_token = self._v2_input_value(sso_auth_response.text, {'id': 'context'})
 
     def _v2_get_authorisation_token(self):
         """
@@ -150,77 +174,195 @@ class ArmorApi:
         logger.debug('performing final v2 authentication request to get authorisation token')
         payload = {'AuthMethod': 'AzureMfaServerAuthentication', 'Context': self.context_token}
         bearer_response = self.session.post(self.bearer_request_url, data=payload)
-        soup = BeautifulSoup(bearer_response.text, 'html.parser')
-        bearer = soup.find('input')['value']
-        with self._token_lock:
+        bearer = self._v2_input_value(bearer_response.text)
+        with self.instrumentation.timed_lock(self._token_lock, 'token'):
             logger.debug('lock acquired to update _authorisation_token')
             self._authorisation_token = bearer
             self._new_token = True
-        logger.debug('Authorisation token set to: %s ' % self._authorisation_token)
+            self._token_generation += 1
+            self._token_issued = time.time()
+        logger.debug('Authorisation token set')
 
-    def _401_timer(self):
+    def start_token_renewal(self, interval=600):
         """
-        counter method that allows n executions every 10 mintes
+        starts a daemon thread that renews the authorisation token once it is interval seconds old, so requests
+        never wait on authentication. v1 tokens are reissued, v2 tokens are renewed by reauthenticating
         """
-        time_now = time.time()
-        if time_now - self._timer > 600:
-            self._timer = time_now
-            self._count401 = self._retries401
+        if not isinstance(interval, (int, float)) or interval <= 0:
+            logger.critical('renewal interval must be a positive number of seconds, the following was provided: %s' % interval)
+            raise ValueError('renewal interval must be a positive number of seconds, the following was provided: %s' % interval)
+        self._renewal_interval = interval
+        if self._renewal_thread and self._renewal_thread.is_alive():
+            return
+        self._renewal_stop.clear()
+        self._renewal_thread = threading.Thread(target=self._token_renewal_loop, name='armorapi-token-renewal', daemon=True)
+        self._renewal_thread.start()
+        logger.debug('Background token renewal started, interval %s seconds' % interval)
 
-        self._count401 -= 1
-        if self._count401 >= 0:
-            return True
-        else:
-            return False
+    def stop_token_renewal(self):
+        """
+        stops the background token renewal thread
+        """
+        self._renewal_stop.set()
+        if self._renewal_thread:
+            self._renewal_thread.join()
+            self._renewal_thread = None
+        logger.debug('Background token renewal stopped')
+
+    def _token_renewal_loop(self):
+        """
+        sleeps until the current token reaches the renewal age, tokens renewed elsewhere (e.g. after a 401) push the
+        next renewal back. Failures are logged and retried, they never stop the thread
+        """
+        while not self._renewal_stop.wait(max(self._token_issued + self._renewal_interval - time.time(), 0)):
+            if time.time() - self._token_issued < self._renewal_interval:
+                continue
+            try:
+                self._renew_token()
+            except (requests.exceptions.RequestException, ValueError, KeyError) as error:
+                logger.error('Background token renewal failed, retrying in %s seconds: %s' % (self._renewal_retry, error))
+                if self._renewal_stop.wait(self._renewal_retry):
+                    return
+
+    def _renew_token(self):
+        """
+        renews the token under _auth_lock so it never overlaps a 401 reauthentication, then applies the new
+        authorisation header so the request path finds it already in place
+        """
+        with self.instrumentation.timed_lock(self._auth_lock, 'auth'):
+            if self._auth == 1:
+                with self.instrumentation.timed_stage('v1_reissue'):
+                    self.v1_reissue_authorisation_token()
+            else:
+                self._authenticate()
+        self._update_authorisation_header()
 
     def _update_authorisation_header(self):
         """
         updates authorisation header in a thread safe manner if an auth token is acquired
         """
         if self._new_token:
-            with self._token_lock:
+            with self.instrumentation.timed_lock(self._token_lock, 'token'):
                 logger.debug('lock acquired to update session header with new token value')
                 self.session.headers.update({'Authorization': '%s %s' % (self._token_prefix, self._authorisation_token)})
                 self._new_token = False
-            logger.debug('New auth token headers updated to: %s' % self.session.headers)
+            logger.debug('New auth token headers updated')
 
-    def _validate_url(self,url):
+    def _reauthenticate(self, generation):
         """
-        performs validation on a url to config domain is in the API whitelist
+        single flight reauthentication after a 401, the first caller reauthenticates while concurrent callers wait on
+        _auth_lock, callers whose request was sent with an older token than the current one skip straight to a retry
         """
-        fqdn = re.findall('^(?:http.+?/+)*(.+?)(?:/.*)*$', url)[0]
-        if fqdn not in self._domain_whitelist:
-            logger.critical('domain: %s not on api whitelist' % fqdn)
-            raise ValueError('domain: %s not on api whitelist' % fqdn)
+        with self.instrumentation.timed_lock(self._auth_lock, 'auth'):
+            if self._token_generation != generation:
+                logger.debug('Authorisation token already renewed by another request, retrying')
+                return True
+            if not self._401_timer():
+                self.instrumentation.reauthentication(False)
+                return False
+            self.instrumentation.reauthentication(True)
+            logger.warning('Attempting reauthentication')
+            self._invalidate_token_cache()
+            self._authenticate()
+            return True
 
-    def make_request(self, url, method='get', data={}, headers={}):
+    def make_request(self, url, method='get', data={}, headers={}, stream=False):
         """
-        Makes a request and returns response, catches exceptions
+        Makes a request and returns response, catches exceptions.
+        A request rejected with a 401 is retried once the token has been renewed, throttled (429) and failed
+        requests are retried according to the scheduler.
+        data is sent as json, bytes are sent as they are so a payload can be serialised once and sent many times,
+        GET requests without data are sent without a body.
+        With stream the body isn't downloaded until it is read from the response.
+        GET requests are served from the response cache when one is set
         """
+        if self.response_cache is not None and method.upper() == 'GET' and not stream:
+            return self._cached_request(url, data, headers)
+        return self._make_request(url, method, data, headers, stream)
 
-        self._validate_url(url)
-        self._update_authorisation_header()
+    def _cached_request(self, url, data, headers):
+        """
+        GET through the response cache, stale entries are revalidated with the cached ETag/Last-Modified
+        """
+        request_headers = requests.structures.CaseInsensitiveDict(headers)
+        accountid = request_headers.get('X-Account-Context', self.session.headers.get('X-Account-Context'))
+        key = self.response_cache.key(url, accountid, request_headers.get('Range'), self._request_body('GET', data),
+                                      self._username)
+        response, conditional_headers = self.response_cache.lookup(key)
+        if response is not None:
+            logger.debug('Response cache hit for %s', url)
+            return response
+        if conditional_headers:
+            revalidation_headers = request_headers.copy()
+            revalidation_headers.update(conditional_headers)
+            response = self._make_request(url, 'GET', data, revalidation_headers, False)
+            if response.status_code == 304:
+                cached_response = self.response_cache.revalidated(key)
+                if cached_response is not None:
+                    logger.debug('Response cache entry revalidated for %s', url)
+                    return cached_response
+                # the entry was evicted or cleared while the request was in flight, a 304 has no body to return
+                logger.debug('Response cache entry for %s dropped during revalidation, requesting it again', url)
+                response.close()
+                response = self._make_request(url, 'GET', data, request_headers, False)
+        else:
+            response = self._make_request(url, 'GET', data, request_headers, False)
+        self.response_cache.store(key, response)
+        return response
+
+    def _make_request(self, url, method, data, headers, stream, attempt=0, reauthenticate=True):
+        """
+        sends a request through the scheduler, retrying it after reauthentication if it is rejected with a 401 (unless
+        reauthenticate is False), and after a delay if it is throttled or fails in a way the scheduler considers retryable
+        """
+        domain = self._validate_url(url)
         method = method.upper()
+        if method not in ('GET', 'POST', 'PUT'):
+            logger.critical('Only GET, POST and PUT are valid make_request methods. %s was provided' % method)
+            raise ValueError('Only GET, POST and PUT are valid make_request methods. %s was provided' % method)
+        if self.instrumentation.pre_request_hooks:
+            headers = dict(headers)
+            self.instrumentation.pre_request(method, url, headers)
+        body = self._request_body(method, data)
+        self.scheduler.before_request(domain)
+
+        connection_error = None
+        response = None
+        generation = self._token_generation
+        start = time.perf_counter()
         try:
-            if method == 'GET':
-                response = self.session.get(url, data=json.dumps(data), headers=headers)
-            elif method == 'POST':
-                response = self.session.post(url, data=json.dumps(data), headers=headers)
-            elif method == 'PUT':
-                response = self.session.put(url, data=json.dumps(data), headers=headers)
-            else:
-                logger.critical('Only GET, POST and PUT are valid make_request methods. %s was provided' % method)        
-                raise ValueError('Only GET, POST and PUT are valid make_request methods. %s was provided' % method)        
+            self._update_authorisation_header()
+            response = self.session.request(method, url, data=body, headers=headers, stream=stream)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as error:
+            connection_error = error
+        except BaseException:
+            # the request never got an outcome, release a half open circuit's trial so the next request can claim it
+            self.scheduler.release(domain)
+            raise
+        delay = self.scheduler.retry_delay(domain, method, attempt, response)
+        self.scheduler.record(domain, response, retrying=delay is not None)
+        if self.instrumentation.observed:
+            self._request_event(method, url, time.perf_counter() - start, len(body or b''), response, stream, attempt, connection_error)
+        if delay is not None:
+            self.instrumentation.retry(domain, 'connection error' if response is None else response.status_code)
+            logger.warning('Request to %s failed (%s), retry %s in %.2f seconds', url, connection_error or response.status_code, attempt + 1, delay)
+            if response is not None:
+                response.close()
+            time.sleep(delay)
+            return self._make_request(url, method, data, headers, stream, attempt + 1, reauthenticate)
 
+        try:
+            if connection_error is not None:
+                raise connection_error
             response.raise_for_status()
 
             return response
 
         except requests.exceptions.HTTPError as error:
-            if response.status_code == 401 and self._401_timer():
+            if response.status_code == 401 and reauthenticate and self._reauthenticate(generation):
                 logger.warning(error)
-                logger.warning('Attempting reauthentication')
-                self._authenticate()
+                response.close()
+                return self._make_request(url, method, data, headers, stream)
             else:
                 logger.critical(error)
                 raise
@@ -231,23 +373,208 @@ class ArmorApi:
             logger.critical(error)
             raise
 
+    def _request_event(self, method, url, elapsed, request_bytes, response, stream, attempt, error):
+        """
+        reports a request attempt to the instrumentation, streamed bodies are counted by their Content-Length
+        """
+        if response is None:
+            status, response_bytes = None, 0
+        elif stream:
+            status, response_bytes = response.status_code, int(response.headers.get('Content-Length', 0))
+        else:
+            status, response_bytes = response.status_code, len(response.content)
+        self.instrumentation.post_request(RequestEvent(method, url, endpoint_label(url), status, elapsed, request_bytes,
+                                                       response_bytes, attempt, error, response))
+
+    def make_requests(self, batch, max_workers=16, domain_limits=None, default_domain_limit=8):
+        """
+        Makes a batch of requests concurrently on a thread pool, returns a BatchResult per request in batch order.
+        Each request is a url or a dict of make_request arguments. A failed request is reported through the error
+        of its BatchResult rather than aborting the batch. domain_limits caps concurrent requests per whitelisted
+        domain, domains not listed are capped at default_domain_limit. The session connection pool holds
+        pool_maxsize connections per domain, caps above it work but don't reuse the extra connections
+        """
+        domain_limits = domain_limits or {}
+        if not isinstance(default_domain_limit, int) or default_domain_limit < 1:
+            logger.critical('default_domain_limit must be a positive integer, the following was provided: %s' % default_domain_limit)
+            raise ValueError('default_domain_limit must be a positive integer, the following was provided: %s' % default_domain_limit)
+        for domain, limit in domain_limits.items():
+            if domain not in self._domain_whitelist:
+                logger.critical('domain: %s not on api whitelist' % domain)
+                raise ValueError('domain: %s not on api whitelist' % domain)
+            if not isinstance(limit, int) or limit < 1:
+                logger.critical('domain limits must be positive integers, the following was provided for %s: %s' % (domain, limit))
+                raise ValueError('domain limits must be positive integers, the following was provided for %s: %s' % (domain, limit))
+        semaphores = {domain: threading.BoundedSemaphore(domain_limits.get(domain, default_domain_limit)) for domain in self._domain_whitelist}
+
+        def run(request):
+            try:
+                kwargs = {'url': request} if isinstance(request, str) else dict(request)
+                with semaphores[self._validate_url(kwargs['url'])]:
+                    return BatchResult(request, self.make_request(**kwargs), None)
+            except Exception as error:
+                logger.warning('Batch request failed: %s', error)
+                return BatchResult(request, None, error)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(run, batch))
+
+    def stream_records(self, url, method='get', data={}, headers={}, items_key=None, chunk_size=65536):
+        """
+        Generator over the records of a large json response, decoded incrementally as the body is downloaded so
+        only one record is held in memory at a time. Records are the elements of a top level json list, the
+        elements of the list under items_key, or each value of a newline delimited json response
+        """
+        response = self.make_request(url, method, data, headers, stream=True)
+        try:
+            yield from iter_json_records(response.iter_content(chunk_size), items_key)
+        finally:
+            response.close()
+
+    def iter_pages(self, url, page_size=100, method='get', data={}, headers={}, items_key=None, start=0, prefetch=0):
+        """
+        Generator over the pages of a paged endpoint, yields one response per page.
+        Pages are selected with the 'Range: entities=first-last' header and followed until the Content-Range total
+        is reached or a short page is returned. Without Content-Range, a response holding more items than page_size,
+        or repeating the previous page, is taken to mean the endpoint isn't paged and ends iteration. prefetch sets
+        how many following pages are requested in the background while the caller works on the current one
+        """
+        for _, response, _ in self._iter_pages(url, page_size, method, data, headers, items_key, start, prefetch):
+            yield response
+
+    def iter_items(self, url, page_size=100, method='get', data={}, headers={}, items_key=None, start=0, prefetch=0):
+        """
+        Generator over the items of a paged endpoint, see iter_pages. items_key names the key holding the list of
+        items when the endpoint doesn't return a plain json list
+        """
+        for _, response, items in self._iter_pages(url, page_size, method, data, headers, items_key, start, prefetch):
+            if items is None:
+                items = page_items(response, items_key)
+            yield from items
+
+    def export(self, url, path, page_size=100, method='get', data={}, headers={}, items_key=None, prefetch=2,
+               compression=None, compression_level=None, resume=True):
+        """
+        Exports every item of a paged endpoint to the file at path as newline delimited json, returns the number of
+        items exported. Pages are fetched prefetch at a time in the background, written as they arrive and then
+        dropped, so memory use doesn't grow with the size of the export. compression is None, 'gzip' or 'zstd'
+        (requires zstandard), each page is compressed separately so the file stays readable with gzip/zstd tools.
+        Progress is checkpointed to path + '.checkpoint' after every page, running the same export again resumes
+        from the last page written, resume=False starts over
+        """
+        request_headers = requests.structures.CaseInsensitiveDict(headers)
+        accountid = request_headers.get('X-Account-Context', self.session.headers.get('X-Account-Context'))
+        signature = export_signature(url, method, data, headers, items_key, compression, accountid)
+
+        def pages(start):
+            for _, response, items in self._iter_pages(url, page_size, method, data, headers, items_key, start, prefetch):
+                yield page_items(response, items_key) if items is None else items
+
+        return export_pages(pages, path, signature, compression, compression_level, resume)
+
+    def _iter_pages(self, url, page_size, method, data, headers, items_key, start, prefetch):
+        """
+        yields (page start, response, items) for each page, items is None unless the page had to be decoded to
+        find the end of the result set. Only page responses that are being prefetched are held in memory
+        """
+        if not isinstance(page_size, int) or page_size < 1:
+            logger.critical('page_size must be a positive integer, the following was provided: %s' % page_size)
+            raise ValueError('page_size must be a positive integer, the following was provided: %s' % page_size)
+
+        def fetch(page_start):
+            return self.make_request(url, method, data, range_headers(headers, page_start, page_size))
+
+        executor = ThreadPoolExecutor(max_workers=prefetch) if prefetch else None
+        pending = collections.deque()
+        next_start = start
+        previous_items = None
+        try:
+            while True:
+                if pending and pending[0][0] == next_start:
+                    page_start, future = pending.popleft()
+                    response = future.result()
+                else:
+                    for _, future in pending:
+                        future.cancel()
+                    pending.clear()
+                    page_start = next_start
+                    response = fetch(page_start)
+
+                items = None
+                content_range = parse_content_range(response)
+                if content_range and content_range[2] is not None:
+                    first, last, total = content_range
+                    next_start = last + 1
+                    more = next_start < total
+                    # the API may serve smaller pages than requested, keep prefetched ranges aligned with it
+                    page_size = min(page_size, last - first + 1)
+                else:
+                    total = None
+                    items = page_items(response, items_key)
+                    next_start = page_start + len(items)
+                    more = len(items) >= page_size
+                    # without Content-Range, an endpoint that ignores the Range header returns its whole result set
+                    # for every page, either as more items than were asked for or as a repeat of the previous page
+                    if len(items) > page_size:
+                        logger.warning('%s returned %s items for a page of %s, treating it as unpaged' % (url, len(items), page_size))
+                        more = False
+                    elif items and items == previous_items:
+                        logger.warning('%s returned the same items for consecutive pages, treating it as unpaged' % url)
+                        return
+                    previous_items = items
+
+                if more and executor:
+                    scheduled = pending[-1][0] + page_size if pending else next_start
+                    while len(pending) < prefetch and (total is None or scheduled < total):
+                        pending.append((scheduled, executor.submit(fetch, scheduled)))
+                        scheduled += page_size
+
+                yield page_start, response, items
+                if not more:
+                    return
+        except requests.exceptions.HTTPError as error:
+            # requesting past the end of a result set without a known total
+            if error.response is not None and error.response.status_code == 416:
+                return
+            raise
+        finally:
+            for _, future in pending:
+                future.cancel()
+            if executor:
+                executor.shutdown(wait=False)
+
+    @property
+    def accountids(self):
+        """
+        account IDs available to the authenticated user
+        """
+        return list(self._accountids)
+
+    def for_account(self, accountid):
+        """
+        returns an AccountView making requests in the context of accountid, sharing this object's authentication
+        """
+        accountid = int(accountid)
+        if accountid not in self._accountids:
+            logger.critical('Provided account ID %s, it not a valid account ID for this account. Valid account IDs: %s' % (accountid, self._accountids))
+            raise ValueError('Provided account ID %s, it not a valid account ID for this account. Valid account IDs: %s' % (accountid, self._accountids))
+        return AccountView(self, accountid)
+
+    def for_accounts(self, accountids=None):
+        """
+        returns an AccountView for each of accountids, by default every account available to the authenticated user
+        """
+        return [self.for_account(accountid) for accountid in (self._accountids if accountids is None else accountids)]
+
     def _test_request_and_accountid(self):
         """
         performs an API request to confirm Authentication has worked, also sets the header for account ID, either as provide ID or First account ID from request
         """
         logger.debug('performing API request to test authentication and get/set account ID')
-        response = self.make_request('https://api.armor.com/me')
+        response = self._make_request('https://api.armor.com/me', 'get', {}, {}, False)
         json_response = response.json()
-        
-        accountids = [x['id'] for x in json_response['accounts']]
-        accountid = json_response['accounts'][0]['id']
-        if not self.accountid and accountid:
-            logger.debug('API request successful, setting account ID to: %s' % accountid)
+
+        accountid = self._select_accountid(json_response)
+        if accountid is not None:
             self.session.headers.update({'X-Account-Context': '%s' % accountid})
-        elif self.accountid:
-            self.accountid = int(self.accountid)
-            if self.accountid not in accountids:
-                 logger.critical('Provided account ID %s, it not a valid account ID for this account. Valid account IDs: %s' % (self.accountid, accountids))
-                 raise ValueError('Provided account ID %s, it not a valid account ID for this account. Valid account IDs: %s' % (self.accountid, accountids))
-            logger.debug('API request successful, however account ID already set to: %s' % self.accountid)
-            self.session.headers.update({'X-Account-Context': '%s' % self.accountid})
+        self._write_token_cache()
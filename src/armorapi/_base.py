@@ -0,0 +1,207 @@
+#!/bin/python3
+import time
+import logging
+import re
+import json
+import hashlib
+import functools
+
+logger = logging.getLogger(__name__)
+
+_url_fqdn = re.compile('^(?:http.+?/+)*(.+?)(?:/.*)*$')
+
+
+@functools.lru_cache(maxsize=1024)
+def _fqdn(url):
+    """
+    domain part of a url, cached as most requests go to a small set of urls
+    """
+    return _url_fqdn.match(url).group(1)
+
+
+class _ArmorApiBase:
+    """
+    Configuration, validation and account handling shared by the sync and async clients.
+    """
+    # seconds a token is accepted from the token cache, v1 tokens are valid for 15 minutes
+    _token_lifetimes = {1: 900, 2: 3600}
+    _token_cache_margin = 60
+
+    def __init__(self,username,password,
+                 accountid=None, retries401=4, auth=1, token_cache=None, adfs_parser='auto'):
+        self.accountid = accountid
+        self._token_cache = token_cache
+        self._cache_key = None
+        self._accountids = []
+        self._context_accountid = None
+        self._auth = auth
+        self._timer = time.time()
+        self._authorisation_token = ''
+        self._new_token = False
+        self._token_generation = 0
+        self._token_issued = 0
+        self._domain_whitelist = frozenset(['amp.armor.com', 'sts.armor.com', 'api.armor.com', 'api.accounts.armor.com', 'agent-management.api.armor.com', 'security-detections.api.secure-prod.services', 'compliance.api.secure-prod.services', 'api.logs.armor.com', 'api.notifications.armor.com', 'webhooks.api.secure-prod.services', 'logs.api.secure-prod.services'])
+
+        self._sanitise_creds(username,password)
+        self._sanitise_retries401(retries401)
+        self._sanitise_adfs_parser(adfs_parser)
+
+    def _sanitise_creds(self,username,password):
+        """
+        sanitises credentials before making them members
+        """
+        if len(password) > 512 or len(username) > 512:
+            logger.critical('username and/or password greater than 512 characters')
+            raise ValueError('username and/or password greater than 512 characters')
+        else:
+            self._username = username
+            self._password = password
+
+    def _sanitise_retries401(self,retries401):
+        """
+        sanitises retires401 input before making it a member
+        """
+        if isinstance(retries401, int) and 1 <= retries401 <=100:
+            self._retries401 = retries401
+            self._count401 = self._retries401
+        else:
+            logger.critical('retries401 must be an integer between 1 and 100, the following was provided: %s' % retries401)
+            raise ValueError('retries401 must be an integer between 1 and 100, the following was provided: %s' % retries401)
+
+    def _sanitise_adfs_parser(self,adfs_parser):
+        """
+        sanitises the v2 login page parser before making it a member
+        """
+        if callable(adfs_parser) or adfs_parser in ('auto', 'html.parser', 'bs4'):
+            self._adfs_parser = adfs_parser
+        else:
+            logger.critical('adfs_parser must be auto, html.parser, bs4 or a callable, the following was provided: %s' % adfs_parser)
+            raise ValueError('adfs_parser must be auto, html.parser, bs4 or a callable, the following was provided: %s' % adfs_parser)
+
+    def _v2_input_value(self, html, attrs=None):
+        """
+        extracts an input value from a v2 ADFS login page, the parser is only imported by v2 authentication
+        """
+        from .adfs import input_value
+        return input_value(html, attrs, self._adfs_parser)
+
+    def _invalid_auth_version(self):
+        """
+        raises for an unsupported authentication version
+        """
+        logger.critical('Invalid auth version provided: %s' % self._auth)
+        raise ValueError('Invalid auth version provided: %s' % self._auth)
+
+    def _v2_set_bearer_request_url(self):
+        """
+        Sets the request url, including parameters for the bearer token request cycles
+        """
+        response_type = 'id_token'
+        response_mode = 'form_post'
+        client_id = 'b2264823-30a3-4706-bf48-4cf80dad76d3'
+        redirect_uri = 'https://amp.armor.com/'
+        self.bearer_request_url = 'https://sts.armor.com/adfs/oauth2/authorize?response_type=%s&response_mode=%s&client_id=%s&redirect_uri=%s' % (response_type, response_mode, client_id, redirect_uri)
+
+    def _401_timer(self):
+        """
+        counter method that allows n executions every 10 mintes
+        """
+        time_now = time.time()
+        if time_now - self._timer > 600:
+            self._timer = time_now
+            self._count401 = self._retries401
+
+        self._count401 -= 1
+        if self._count401 >= 0:
+            return True
+        else:
+            return False
+
+    def _validate_url(self,url):
+        """
+        performs validation on a url to config domain is in the API whitelist, returns the domain
+        """
+        fqdn = _fqdn(url)
+        if fqdn not in self._domain_whitelist:
+            logger.critical('domain: %s not on api whitelist' % fqdn)
+            raise ValueError('domain: %s not on api whitelist' % fqdn)
+        return fqdn
+
+    def _request_body(self, method, data):
+        """
+        serialises request data to json, bytes are taken as already serialised and GET requests without data are
+        sent without a body
+        """
+        if isinstance(data, (bytes, bytearray)):
+            return data
+        if method == 'GET' and not data:
+            return None
+        return json.dumps(data)
+
+    def _select_accountid(self, json_response):
+        """
+        picks the account ID to use from a /me response, either the provided ID or the first account ID returned
+        """
+        accountids = [x['id'] for x in json_response['accounts']]
+        accountid = json_response['accounts'][0]['id']
+        self._accountids = accountids
+        if not self.accountid and accountid:
+            logger.debug('API request successful, setting account ID to: %s' % accountid)
+            self._context_accountid = accountid
+            return accountid
+        elif self.accountid:
+            self.accountid = int(self.accountid)
+            if self.accountid not in accountids:
+                 logger.critical('Provided account ID %s, it not a valid account ID for this account. Valid account IDs: %s' % (self.accountid, accountids))
+                 raise ValueError('Provided account ID %s, it not a valid account ID for this account. Valid account IDs: %s' % (self.accountid, accountids))
+            logger.debug('API request successful, however account ID already set to: %s' % self.accountid)
+            self._context_accountid = self.accountid
+            return self.accountid
+
+    def _token_cache_key(self):
+        """
+        token cache key for these credentials, derived from the password as well as the username so a cached token is
+        only found with the right password. Stretched with PBKDF2 as the key is stored with the cache and usernames
+        and passwords mustn't be recoverable from it, computed once per api object
+        """
+        if self._cache_key is None:
+            salt = ('armorapi:%s:%s' % (self._auth, self._username)).encode()
+            self._cache_key = hashlib.pbkdf2_hmac('sha256', self._password.encode(), salt, 20000).hex()
+        return self._cache_key
+
+    def _read_token_cache(self):
+        """
+        returns a cached token entry that is still valid and covers the requested account ID, otherwise None
+        """
+        if self._token_cache is None:
+            return None
+        entry = self._token_cache.get(self._token_cache_key())
+        if not entry or entry['expires'] <= time.time():
+            return None
+        if self.accountid and int(self.accountid) not in entry['accountids']:
+            return None
+        logger.debug('Using cached authorisation token')
+        self._accountids = entry['accountids']
+        self._context_accountid = int(self.accountid) if self.accountid else entry['accountids'][0]
+        if self.accountid:
+            self.accountid = self._context_accountid
+        return entry
+
+    def _write_token_cache(self):
+        """
+        stores the current token and resolved account IDs in the token cache
+        """
+        if self._token_cache is None:
+            return
+        entry = {'token': self._authorisation_token, 'prefix': self._token_prefix, 'accountids': self._accountids,
+                 'issued': self._token_issued,
+                 'expires': self._token_issued + self._token_lifetimes[self._auth] - self._token_cache_margin}
+        self._token_cache.set(self._token_cache_key(), entry)
+
+    def _invalidate_token_cache(self):
+        """
+        removes the cached token for these credentials, called when the API rejects it
+        """
+        if self._token_cache is not None:
+            logger.debug('Invalidating cached authorisation token')
+            self._token_cache.delete(self._token_cache_key())
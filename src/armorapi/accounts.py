@@ -0,0 +1,48 @@
+#!/bin/python3
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class AccountView:
+    """
+    An ArmorApi object bound to one account ID. Views share the api object's token, session, caches and scheduler,
+    the account ID is sent as a per request X-Account-Context header so the shared session is never modified and
+    views for different accounts can be used from different threads at the same time
+    """
+
+    def __init__(self, api, accountid):
+        self.api = api
+        self.accountid = accountid
+
+    def __repr__(self):
+        return 'AccountView(accountid=%s)' % self.accountid
+
+    def _headers(self, headers):
+        account_headers = dict(headers)
+        account_headers['X-Account-Context'] = '%s' % self.accountid
+        return account_headers
+
+    def make_request(self, url, method='get', data={}, headers={}, stream=False):
+        return self.api.make_request(url, method, data, self._headers(headers), stream)
+
+    def make_requests(self, batch, **kwargs):
+        account_batch = []
+        for request in batch:
+            kwargs_request = {'url': request} if isinstance(request, str) else dict(request)
+            kwargs_request['headers'] = self._headers(kwargs_request.get('headers', {}))
+            account_batch.append(kwargs_request)
+        results = self.api.make_requests(account_batch, **kwargs)
+        return [result._replace(request=request) for request, result in zip(batch, results)]
+
+    def iter_pages(self, url, page_size=100, method='get', data={}, headers={}, items_key=None, start=0, prefetch=0):
+        return self.api.iter_pages(url, page_size, method, data, self._headers(headers), items_key, start, prefetch)
+
+    def iter_items(self, url, page_size=100, method='get', data={}, headers={}, items_key=None, start=0, prefetch=0):
+        return self.api.iter_items(url, page_size, method, data, self._headers(headers), items_key, start, prefetch)
+
+    def stream_records(self, url, method='get', data={}, headers={}, items_key=None, chunk_size=65536):
+        return self.api.stream_records(url, method, data, self._headers(headers), items_key, chunk_size)
+
+    def export(self, url, path, headers={}, **kwargs):
+        return self.api.export(url, path, headers=self._headers(headers), **kwargs)
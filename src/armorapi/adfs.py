@@ -0,0 +1,66 @@
+#!/bin/python3
+import logging
+from html.parser import HTMLParser
+
+logger = logging.getLogger(__name__)
+
+
+class _InputParser(HTMLParser):
+    """
+    finds the first <input> element whose attributes match attrs and keeps its value, the rest of the page is skipped
+    """
+
+    def __init__(self, attrs):
+        super().__init__(convert_charrefs=True)
+        self.attrs = attrs
+        self.value = None
+        self.found = False
+
+    def handle_starttag(self, tag, attrs):
+        if self.found or tag != 'input':
+            return
+        attrs = dict(attrs)
+        if all(attrs.get(key) == value for key, value in self.attrs.items()):
+            self.found = True
+            self.value = attrs.get('value')
+
+
+def _html_parser_input_value(html, attrs):
+    parser = _InputParser(attrs)
+    # ADFS pages are small, but stop feeding once the input is found rather than tokenising the whole page
+    for start in range(0, len(html), 4096):
+        parser.feed(html[start:start + 4096])
+        if parser.found:
+            break
+    return parser.value
+
+
+def _bs4_input_value(html, attrs):
+    from bs4 import BeautifulSoup
+    element = BeautifulSoup(html, 'html.parser').find('input', attrs)
+    return element.get('value') if element is not None else None
+
+
+def input_value(html, attrs=None, parser='auto'):
+    """
+    returns the value of the first <input> element in an ADFS login page whose attributes match attrs.
+    parser is 'html.parser' for the built in extractor, 'bs4' for BeautifulSoup, 'auto' to use the built in extractor
+    and fall back to BeautifulSoup, when it is installed, for pages the extractor can't find the input in, or a
+    callable taking (html, attrs) and returning the value
+    """
+    attrs = attrs or {}
+    if callable(parser):
+        value = parser(html, attrs)
+    elif parser == 'bs4':
+        value = _bs4_input_value(html, attrs)
+    else:
+        value = _html_parser_input_value(html, attrs)
+        if value is None and parser == 'auto':
+            try:
+                value = _bs4_input_value(html, attrs)
+            except ImportError:
+                pass
+    if value is None:
+        logger.critical('v2 authentication response has no input element with a value matching: %s' % attrs)
+        raise ValueError('v2 authentication response has no input element with a value matching: %s' % attrs)
+    return value
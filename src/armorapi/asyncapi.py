@@ -0,0 +1,279 @@
+#!/bin/python3
+import time
+import logging
+from ._base import _ArmorApiBase
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncArmorApi(_ArmorApiBase):
+    """
+    asyncio Rest API client for the Armor API, manages 0auth2 authentication over a shared keep-alive connection pool.
+    Requires the optional aiohttp dependency.
+
+    Authentication is a network operation so it can't happen in __init__, use the client as an async context manager
+    or await authenticate() before making requests.
+    """
+
+    def __init__(self,username,password,
+                 accountid=None, retries401=4, auth=1,
+                 pool_size=100, pool_size_per_host=20, keepalive_timeout=30, token_cache=None, session=None,
+                 adfs_parser='auto'):
+        super().__init__(username, password, accountid, retries401, auth, token_cache, adfs_parser)
+        self._headers = {'Accept': 'application/json', 'Content-Type': 'application/json'}
+        self._pool_size = pool_size
+        self._pool_size_per_host = pool_size_per_host
+        self._keepalive_timeout = keepalive_timeout
+        self._token_lock = None
+        self._auth_lock = None
+        self._auth_task = None
+        self.session = session
+        self._owns_session = session is None
+        self._aiohttp = None
+        logger.debug('initialising async armor api')
+
+    async def __aenter__(self):
+        await self.authenticate()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def _create_session(self):
+        """
+        creates the aiohttp session and bounded connection pool used for all requests, unless a session was provided.
+        The locks are created here, inside the running loop, as before python 3.10 they bind to the loop they are
+        created in
+        """
+        # asyncio is imported here rather than at module level so sync only users of armorapi don't pay for it
+        import asyncio
+        self._token_lock = asyncio.Lock()
+        self._auth_lock = asyncio.Lock()
+        try:
+            import aiohttp
+        except ImportError:
+            logger.critical('AsyncArmorApi requires aiohttp, install with: pip install armorapi[async]')
+            raise
+        self._aiohttp = aiohttp
+        if self.session is not None:
+            return
+        connector = aiohttp.TCPConnector(limit=self._pool_size, limit_per_host=self._pool_size_per_host,
+                                         keepalive_timeout=self._keepalive_timeout)
+        self.session = aiohttp.ClientSession(connector=connector)
+
+    async def authenticate(self):
+        """
+        opens the connection pool if needed and performs authentication, unless a valid token is in the token cache
+        """
+        if self._aiohttp is None:
+            self._create_session()
+        if not await self._load_cached_token():
+            await self._authenticate()
+
+    async def _load_cached_token(self):
+        """
+        restores token, prefix and account context from the token cache, returns False if there's no usable entry
+        """
+        entry = self._read_token_cache()
+        if entry is None:
+            return False
+        async with self._token_lock:
+            self._token_prefix = entry['prefix']
+            self._authorisation_token = entry['token']
+            self._new_token = True
+            self._token_generation += 1
+            self._token_issued = entry['issued']
+        self._headers['X-Account-Context'] = '%s' % self._context_accountid
+        self._update_authorisation_header()
+        return True
+
+    async def close(self):
+        """
+        closes the connection pool, a session provided to the api object is left open
+        """
+        if self.session is not None and self._owns_session:
+            await self.session.close()
+            self.session = None
+            self._aiohttp = None
+
+    async def _authenticate(self):
+        """
+        Executes authentication depending on authentication version selected
+        """
+        if self._auth == 1:
+            await self._v1_authentication()
+        elif self._auth == 2:
+            await self._v2_authentication()
+        else:
+            self._invalid_auth_version()
+
+    async def _v1_authentication(self):
+        self._token_prefix = 'FH-AUTH'
+        await self._v1_get_authentication_token()
+        await self._v1_get_authorisation_token()
+        await self._test_request_and_accountid()
+
+    async def _v1_get_authentication_token(self):
+        """
+        1st stage v1, Perform initial authentication,
+        to recieve authentication token
+        """
+        logger.debug('Performing initial v1 authentication to get authentication token')
+        payload = {'userName': self._username, 'password': self._password}
+        response = await self.make_request('https://api.armor.com/auth/authorize', method="post", data=payload)
+        json_response = await response.json(content_type=None)
+        logger.debug('API returned the following keys: %s' % list(json_response))
+        self.v1_authcode = json_response.get('code')
+
+    async def _v1_get_authorisation_token(self):
+        """
+        2nd stage v1, use authentication token to get authorisation token to use on subsequent API requests
+        """
+        logger.debug('Performing 2nd stage v1 authentication, use authentication token to get authorisation token')
+        payload = {'code': self.v1_authcode, 'grant_type': 'authorization_code'}
+        response = await self.make_request('https://api.armor.com/auth/token', method='post', data=payload)
+        json_response = await response.json(content_type=None)
+        logger.debug('API returned the following keys: %s' % list(json_response))
+        async with self._token_lock:
+            logger.debug('lock acquired to update _authorisation_token')
+            self._authorisation_token = json_response.get('access_token')
+            self._new_token = True
+            self._token_generation += 1
+            self._token_issued = time.time()
+        logger.debug('Authorisation token set')
+
+    async def v1_reissue_authorisation_token(self):
+        """
+        v1 authorisation renew authorisation token
+        """
+        logger.debug('Renewing authorisation token (v1 auth)')
+        payload = {'token': self._authorisation_token}
+        response = await self.make_request('https://api.armor.com/auth/token/reissue', method='post', data=payload)
+        json_response = await response.json(content_type=None)
+        logger.debug('API returned the following keys: %s' % list(json_response))
+        async with self._token_lock:
+            logger.debug('lock acquired to update _authorisation_token')
+            self._authorisation_token = json_response.get('access_token')
+            self._new_token = True
+            self._token_generation += 1
+            self._token_issued = time.time()
+        logger.debug('Authorisation token renewed')
+        self._write_token_cache()
+
+    async def _v2_authentication(self):
+        self._token_prefix = 'Bearer'
+        self._v2_set_bearer_request_url()
+        await self._v2_get_authentication_token()
+        await self._v2_get_authorisation_token()
+        await self._test_request_and_accountid()
+
+    async def _v2_get_authentication_token(self):
+        """
+        Completes the initial username/password auth and retrieves authentication token.
+        """
+        logger.debug('Performing initial v2 authentication to get authentication token')
+        payload = {'UserName': self._username, 'Password': self._password, 'AuthMethod': 'FormsAuthentication'}
+        async with self.session.post(self.bearer_request_url, data=payload, headers=self._headers) as sso_auth_response:
+            html = await sso_auth_response.text()
+        self.context_token = self._v2_input_value(html, {'id': 'context'})
+
+    async def _v2_get_authorisation_token(self):
+        """
+        2nd stage v2, use authentication token to get authorisation token to use on subsequent API requests
+        """
+        logger.debug('performing final v2 authentication request to get authorisation token')
+        payload = {'AuthMethod': 'AzureMfaServerAuthentication', 'Context': self.context_token}
+        async with self.session.post(self.bearer_request_url, data=payload, headers=self._headers) as bearer_response:
+            html = await bearer_response.text()
+        bearer = self._v2_input_value(html)
+        async with self._token_lock:
+            logger.debug('lock acquired to update _authorisation_token')
+            self._authorisation_token = bearer
+            self._new_token = True
+            self._token_generation += 1
+            self._token_issued = time.time()
+        logger.debug('Authorisation token set')
+
+    def _update_authorisation_header(self):
+        """
+        updates authorisation header if an auth token is acquired, runs on the event loop so needs no lock
+        """
+        if self._new_token:
+            self._headers['Authorization'] = '%s %s' % (self._token_prefix, self._authorisation_token)
+            self._new_token = False
+            logger.debug('New auth token headers updated')
+
+    async def _reauthenticate(self, generation):
+        """
+        single flight reauthentication after a 401, the first task reauthenticates while concurrent tasks wait on
+        _auth_lock. asyncio locks aren't reentrant, so requests made by the reauthenticating task itself skip the lock
+        """
+        import asyncio
+        if self._auth_task is asyncio.current_task():
+            return await self._reauthenticate_locked(generation)
+        async with self._auth_lock:
+            self._auth_task = asyncio.current_task()
+            try:
+                return await self._reauthenticate_locked(generation)
+            finally:
+                self._auth_task = None
+
+    async def _reauthenticate_locked(self, generation):
+        if self._token_generation != generation:
+            logger.debug('Authorisation token already renewed by another request, retrying')
+            return True
+        if not self._401_timer():
+            return False
+        logger.warning('Attempting reauthentication')
+        self._invalidate_token_cache()
+        await self._authenticate()
+        return True
+
+    async def make_request(self, url, method='get', data={}, headers={}):
+        """
+        Makes a request and returns the response with its body already read, catches exceptions.
+        A request rejected with a 401 is retried once the token has been renewed.
+        data is sent as json, bytes are sent as they are and GET requests without data are sent without a body
+        """
+        if self._aiohttp is None:
+            self._create_session()
+        self._validate_url(url)
+        generation = self._token_generation
+        self._update_authorisation_header()
+        method = method.upper()
+        if method not in ('GET', 'POST', 'PUT'):
+            logger.critical('Only GET, POST and PUT are valid make_request methods. %s was provided' % method)
+            raise ValueError('Only GET, POST and PUT are valid make_request methods. %s was provided' % method)
+
+        request_headers = dict(self._headers)
+        request_headers.update(headers)
+        try:
+            async with self.session.request(method, url, data=self._request_body(method, data), headers=request_headers) as response:
+                await response.read()
+            response.raise_for_status()
+
+            return response
+
+        except self._aiohttp.ClientResponseError as error:
+            if error.status == 401 and await self._reauthenticate(generation):
+                logger.warning(error)
+                return await self.make_request(url, method, data, headers)
+            else:
+                logger.critical(error)
+                raise
+        except self._aiohttp.ClientError as error:
+            logger.critical(error)
+            raise
+
+    async def _test_request_and_accountid(self):
+        """
+        performs an API request to confirm Authentication has worked, also sets the header for account ID, either as provide ID or First account ID from request
+        """
+        logger.debug('performing API request to test authentication and get/set account ID')
+        response = await self.make_request('https://api.armor.com/me')
+        json_response = await response.json(content_type=None)
+
+        accountid = self._select_accountid(json_response)
+        if accountid is not None:
+            self._headers['X-Account-Context'] = '%s' % accountid
+        self._write_token_cache()
@@ -0,0 +1,104 @@
+#!/bin/python3
+import os
+import json
+import gzip
+import hashlib
+import logging
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+
+def export_signature(url, method, data, headers, items_key, compression, accountid):
+    """
+    identifies an export, a checkpoint is only resumed by an export with the same signature
+    """
+    export = {'url': url, 'method': method.upper(), 'data': data, 'items_key': items_key, 'compression': compression,
+              'accountid': accountid, 'headers': {key: value for key, value in headers.items() if key.lower() != 'range'}}
+    return hashlib.sha256(json.dumps(export, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _compressor(compression, level):
+    """
+    returns a function compressing a page into a self contained gzip member or zstd frame. Concatenated members and
+    frames decompress as one stream, so the file is complete after every page and can be truncated at any page
+    """
+    if compression is None:
+        return None
+    if compression == 'gzip':
+        return lambda page: gzip.compress(page, compresslevel=6 if level is None else level)
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            logger.critical('zstd compression requires zstandard, install with: pip install armorapi[zstd]')
+            raise
+        return zstandard.ZstdCompressor(level=3 if level is None else level).compress
+    logger.critical('compression must be None, gzip or zstd, the following was provided: %s' % compression)
+    raise ValueError('compression must be None, gzip or zstd, the following was provided: %s' % compression)
+
+
+def _read_checkpoint(path):
+    try:
+        with open(path) as checkpoint_file:
+            return json.load(checkpoint_file)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as error:
+        logger.warning('Unable to read export checkpoint %s, ignoring it: %s' % (path, error))
+        return None
+
+
+def _write_checkpoint(path, checkpoint):
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.checkpoint-')
+    try:
+        with os.fdopen(fd, 'w') as checkpoint_file:
+            json.dump(checkpoint, checkpoint_file)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def export_pages(pages, path, signature, compression=None, compression_level=None, resume=True):
+    """
+    Writes the items of each page from pages(start) to path as newline delimited json, returns the number of items
+    in the file. After every page the file is flushed and the next start and file offset are recorded in
+    path + '.checkpoint', an interrupted export is resumed from there by truncating the file to the recorded offset.
+    The checkpoint is removed once the export completes
+    """
+    compress = _compressor(compression, compression_level)
+    checkpoint_path = path + '.checkpoint'
+    checkpoint = _read_checkpoint(checkpoint_path) if resume else None
+    if checkpoint is not None and checkpoint.get('signature') != signature:
+        logger.critical('Export checkpoint %s is for a different export, remove it or export with resume=False' % checkpoint_path)
+        raise ValueError('Export checkpoint %s is for a different export, remove it or export with resume=False' % checkpoint_path)
+    if checkpoint is not None and (not os.path.exists(path) or os.path.getsize(path) < checkpoint['offset']):
+        logger.warning('Export file %s is shorter than its checkpoint records, restarting the export' % path)
+        checkpoint = None
+
+    start, offset = (checkpoint['next_start'], checkpoint['offset']) if checkpoint else (0, 0)
+    if checkpoint:
+        logger.debug('Resuming export to %s from item %s', path, start)
+    with open(path, 'r+b' if checkpoint else 'wb') as export_file:
+        export_file.seek(offset)
+        export_file.truncate()
+        for items in pages(start):
+            if not items:
+                continue
+            page = ''.join(json.dumps(item, separators=(',', ':')) + '\n' for item in items).encode('utf-8')
+            if compress is not None:
+                page = compress(page)
+            export_file.write(page)
+            export_file.flush()
+            start += len(items)
+            offset += len(page)
+            _write_checkpoint(checkpoint_path, {'signature': signature, 'next_start': start, 'offset': offset})
+
+    try:
+        os.remove(checkpoint_path)
+    except FileNotFoundError:
+        pass
+    logger.debug('Exported %s items to %s', start, path)
+    return start
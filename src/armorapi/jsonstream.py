@@ -0,0 +1,126 @@
+#!/bin/python3
+import re
+import codecs
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+_whitespace = ' \t\n\r'
+_number_start = '-0123456789'
+_number_chars = re.compile(r'[-+.eE0-9]*')
+
+
+class _JsonRecordReader:
+    """
+    Incremental json reader over an iterable of byte chunks. Only the record being decoded and the unread part of
+    the current chunk are buffered
+    """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._decoder = json.JSONDecoder()
+        self._utf8 = codecs.getincrementaldecoder('utf-8')()
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self):
+        """
+        at least doubles the unread part of the buffer, so retrying a partial record stays linear in its size
+        """
+        self._buffer = self._buffer[self._pos:]
+        self._pos = 0
+        wanted = max(len(self._buffer) * 2, 1)
+        while not self._eof and len(self._buffer) < wanted:
+            try:
+                chunk = next(self._chunks)
+            except StopIteration:
+                self._buffer += self._utf8.decode(b'', final=True)
+                self._eof = True
+                break
+            self._buffer += self._utf8.decode(chunk) if isinstance(chunk, bytes) else chunk
+
+    def peek(self):
+        """
+        skips whitespace and returns the next character, None at the end of the stream
+        """
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in _whitespace:
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if self._eof:
+                return None
+            self._fill()
+
+    def expect(self, characters):
+        character = self.peek()
+        if character is None or character not in characters:
+            raise ValueError('Invalid json stream, expected one of %r but found %r' % (characters, character))
+        self._pos += 1
+        return character
+
+    def value(self):
+        """
+        decodes the next complete json value
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+                self._fill()
+                continue
+            # a number running into the end of the buffer may continue in the next chunk, raw_decode stops early at
+            # a '.' or exponent that is cut off, so check the rest of the buffer is only number characters
+            if not self._eof and self._buffer[self._pos] in _number_start and _number_chars.match(self._buffer, end).end() == len(self._buffer):
+                self._fill()
+                continue
+            self._pos = end
+            return value
+
+    def array(self):
+        """
+        yields the elements of the array that starts at the current position
+        """
+        self.expect('[')
+        if self.peek() == ']':
+            self._pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.expect(',]') == ']':
+                return
+
+
+def iter_json_records(chunks, items_key=None):
+    """
+    Yields records from a json document delivered as an iterable of byte chunks, without decoding the whole document.
+    A top level array yields its elements, with items_key the elements of the array under that key of a top level
+    object are yielded, anything else (e.g. newline delimited json) yields each top level value
+    """
+    reader = _JsonRecordReader(chunks)
+    first = reader.peek()
+    if first == '[':
+        yield from reader.array()
+    elif first == '{' and items_key is not None:
+        reader.expect('{')
+        while reader.peek() != '}':
+            key = reader.value()
+            reader.expect(':')
+            if key == items_key:
+                if reader.peek() != '[':
+                    logger.critical('json stream value under items_key %s is not a list' % items_key)
+                    raise ValueError('json stream value under items_key %s is not a list' % items_key)
+                yield from reader.array()
+                return
+            reader.value()
+            if reader.expect(',}') == '}':
+                break
+        logger.debug('items_key %s not found in json stream' % items_key)
+    else:
+        while reader.peek() is not None:
+            yield reader.value()
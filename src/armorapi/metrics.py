@@ -0,0 +1,217 @@
+#!/bin/python3
+import re
+import time
+import logging
+import threading
+import contextlib
+import collections
+
+logger = logging.getLogger(__name__)
+
+RequestEvent = collections.namedtuple('RequestEvent', ['method', 'url', 'endpoint', 'status', 'elapsed', 'request_bytes',
+                                                       'response_bytes', 'attempt', 'error', 'response'])
+
+_endpoint_ids = re.compile(r'/(?:\d+|[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12})(?=/|$)')
+
+
+def endpoint_label(url):
+    """
+    domain and path of a url with query strings dropped and numeric/uuid path segments replaced by {id},
+    so endpoints group into a bounded set of labels
+    """
+    endpoint = url.split('://', 1)[-1].split('?', 1)[0]
+    return _endpoint_ids.sub('/{id}', endpoint)
+
+
+class Instrumentation:
+    """
+    Hooks called by the api object around requests and inside authentication.
+    Pre request hooks are called with (method, url, headers) before each request is sent and may add headers,
+    post request hooks are called with a RequestEvent for every attempt, including failed and retried attempts.
+    Collectors (e.g. MetricsCollector) additionally receive authentication stage timings, reauthentication,
+    retry and lock wait events
+    """
+
+    def __init__(self, collectors=None):
+        self.pre_request_hooks = []
+        self.post_request_hooks = []
+        self.collectors = list(collectors or [])
+
+    def add_pre_request_hook(self, hook):
+        self.pre_request_hooks.append(hook)
+
+    def add_post_request_hook(self, hook):
+        self.post_request_hooks.append(hook)
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    @property
+    def observed(self):
+        """
+        True if any post request hook or collector is registered, request events are only built when observed
+        """
+        return bool(self.post_request_hooks or self.collectors)
+
+    def pre_request(self, method, url, headers):
+        for hook in self.pre_request_hooks:
+            hook(method, url, headers)
+
+    def post_request(self, event):
+        for hook in self.post_request_hooks:
+            hook(event)
+        for collector in self.collectors:
+            collector.record_request(event)
+
+    def auth_stage(self, stage, elapsed):
+        for collector in self.collectors:
+            collector.record_auth_stage(stage, elapsed)
+
+    def reauthentication(self, allowed):
+        for collector in self.collectors:
+            collector.record_reauthentication(allowed)
+
+    def retry(self, domain, reason):
+        for collector in self.collectors:
+            collector.record_retry(domain, reason)
+
+    def lock_wait(self, lock, elapsed):
+        for collector in self.collectors:
+            collector.record_lock_wait(lock, elapsed)
+
+    @contextlib.contextmanager
+    def timed_stage(self, stage):
+        """
+        times the enclosed authentication stage, failed stages are recorded too
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.auth_stage(stage, time.perf_counter() - start)
+
+    @contextlib.contextmanager
+    def timed_lock(self, lock, name):
+        """
+        acquires lock, recording how long the acquire waited
+        """
+        start = time.perf_counter()
+        with lock:
+            self.lock_wait(name, time.perf_counter() - start)
+            yield
+
+
+class Histogram:
+    """
+    cumulative bucket histogram in the Prometheus style
+    """
+    default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self, buckets=None):
+        self.buckets = tuple(buckets or self.default_buckets)
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _labels(**labels):
+    return '{%s}' % ','.join('%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                             for key, value in labels.items())
+
+
+class MetricsCollector:
+    """
+    Collects request latency histograms, bytes transferred and status counts per endpoint, authentication stage
+    timings, reauthentication and retry counts and lock wait times, exportable in the Prometheus text format
+    """
+
+    def __init__(self, buckets=None):
+        self._buckets = buckets
+        self._lock = threading.Lock()
+        self.latency = collections.defaultdict(self._histogram)
+        self.request_bytes = collections.Counter()
+        self.response_bytes = collections.Counter()
+        self.statuses = collections.Counter()
+        self.errors = collections.Counter()
+        self.auth_stages = collections.defaultdict(self._histogram)
+        self.reauthentications = collections.Counter()
+        self.retries = collections.Counter()
+        self.lock_waits = collections.defaultdict(self._histogram)
+
+    def _histogram(self):
+        return Histogram(self._buckets)
+
+    def record_request(self, event):
+        key = (event.method, event.endpoint)
+        with self._lock:
+            self.latency[key].observe(event.elapsed)
+            self.request_bytes[key] += event.request_bytes
+            self.response_bytes[key] += event.response_bytes
+            if event.status is not None:
+                self.statuses[key + (event.status,)] += 1
+            if event.error is not None:
+                self.errors[key + (type(event.error).__name__,)] += 1
+
+    def record_auth_stage(self, stage, elapsed):
+        with self._lock:
+            self.auth_stages[stage].observe(elapsed)
+
+    def record_reauthentication(self, allowed):
+        with self._lock:
+            self.reauthentications['allowed' if allowed else 'denied'] += 1
+
+    def record_retry(self, domain, reason):
+        with self._lock:
+            self.retries[(domain, reason)] += 1
+
+    def record_lock_wait(self, lock, elapsed):
+        with self._lock:
+            self.lock_waits[lock].observe(elapsed)
+
+    def _histogram_lines(self, name, histograms, label_names):
+        lines = []
+        for key, histogram in sorted(histograms.items()):
+            labels = dict(zip(label_names, key if isinstance(key, tuple) else (key,)))
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                lines.append('%s_bucket%s %s' % (name, _labels(**labels, le=bound), count))
+            lines.append('%s_bucket%s %s' % (name, _labels(**labels, le='+Inf'), histogram.count))
+            lines.append('%s_sum%s %s' % (name, _labels(**labels), histogram.sum))
+            lines.append('%s_count%s %s' % (name, _labels(**labels), histogram.count))
+        return lines
+
+    def _counter_lines(self, name, counter, label_names):
+        return ['%s%s %s' % (name, _labels(**dict(zip(label_names, key if isinstance(key, tuple) else (key,)))), value)
+                for key, value in sorted(counter.items())]
+
+    def to_prometheus(self):
+        """
+        returns the collected metrics in the Prometheus text exposition format
+        """
+        metrics = [
+            ('armorapi_request_duration_seconds', 'histogram', 'Request latency by endpoint', self.latency, ('method', 'endpoint')),
+            ('armorapi_request_bytes_total', 'counter', 'Request body bytes sent by endpoint', self.request_bytes, ('method', 'endpoint')),
+            ('armorapi_response_bytes_total', 'counter', 'Response body bytes received by endpoint', self.response_bytes, ('method', 'endpoint')),
+            ('armorapi_responses_total', 'counter', 'Responses by endpoint and status code', self.statuses, ('method', 'endpoint', 'status')),
+            ('armorapi_request_errors_total', 'counter', 'Requests that failed without a response', self.errors, ('method', 'endpoint', 'error')),
+            ('armorapi_auth_stage_duration_seconds', 'histogram', 'Time spent in each authentication stage', self.auth_stages, ('stage',)),
+            ('armorapi_reauthentications_total', 'counter', 'Reauthentications after a 401, denied once the retries401 budget is spent', self.reauthentications, ('result',)),
+            ('armorapi_retries_total', 'counter', 'Requests retried by the scheduler', self.retries, ('domain', 'reason')),
+            ('armorapi_lock_wait_seconds', 'histogram', 'Time spent waiting to acquire token and authentication locks', self.lock_waits, ('lock',)),
+        ]
+        lines = []
+        with self._lock:
+            for name, metric_type, description, values, label_names in metrics:
+                lines.append('# HELP %s %s' % (name, description))
+                lines.append('# TYPE %s %s' % (name, metric_type))
+                if metric_type == 'histogram':
+                    lines.extend(self._histogram_lines(name, values, label_names))
+                else:
+                    lines.extend(self._counter_lines(name, values, label_names))
+        return '\n'.join(lines) + '\n'
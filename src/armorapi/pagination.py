@@ -0,0 +1,50 @@
+#!/bin/python3
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+_content_range = re.compile(r'(\d+)-(\d+)/(\d+|\*)')
+
+
+def range_headers(headers, start, page_size):
+    """
+    returns a copy of headers with the Range header selecting page_size entities from start
+    """
+    page_headers = dict(headers)
+    page_headers['Range'] = 'entities=%s-%s' % (start, start + page_size - 1)
+    return page_headers
+
+
+def parse_content_range(response):
+    """
+    parses a Content-Range response header, e.g. 'entities 0-99/1200', into (first, last, total).
+    total is None when the API reports it as unknown, None is returned when the header is missing
+    """
+    match = _content_range.search(response.headers.get('Content-Range', ''))
+    if not match:
+        return None
+    first, last, total = match.groups()
+    return int(first), int(last), None if total == '*' else int(total)
+
+
+def page_items(response, items_key=None):
+    """
+    returns the list of items in a page, either the json response itself or the list under items_key
+    """
+    json_response = response.json()
+    if items_key is not None:
+        if not isinstance(json_response, dict):
+            logger.critical('Paged response is not an object, it has no items_key %s' % items_key)
+            raise ValueError('Paged response is not an object, it has no items_key %s' % items_key)
+        items = json_response.get(items_key)
+        if items is None:
+            return []
+        if not isinstance(items, list):
+            logger.critical('Paged response value under items_key %s is not a list' % items_key)
+            raise ValueError('Paged response value under items_key %s is not a list' % items_key)
+        return items
+    if isinstance(json_response, list):
+        return json_response
+    logger.critical('Paged response is not a list, items_key must name the key holding the items')
+    raise ValueError('Paged response is not a list, items_key must name the key holding the items')
@@ -0,0 +1,101 @@
+#!/bin/python3
+import time
+import logging
+import threading
+import collections
+
+logger = logging.getLogger(__name__)
+
+_CacheEntry = collections.namedtuple('_CacheEntry', ['response', 'expires', 'validators'])
+
+
+class ResponseCache:
+    """
+    LRU cache for GET responses, keyed on the user the client authenticates as, url, account context, Range header and
+    serialised request body, so a cache can be shared by clients authenticating as different users.
+    Entries live for ttl seconds, or the ttl of the longest matching url prefix in ttls. Expired entries with an
+    ETag or Last-Modified header are kept and revalidated with a conditional request, a 304 renews them
+    """
+
+    def __init__(self, maxsize=256, ttl=60, ttls=None):
+        if not isinstance(maxsize, int) or maxsize < 1:
+            logger.critical('maxsize must be a positive integer, the following was provided: %s' % maxsize)
+            raise ValueError('maxsize must be a positive integer, the following was provided: %s' % maxsize)
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.ttls = dict(ttls or {})
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def key(self, url, accountid=None, range_header=None, body=None, identity=None):
+        return url, accountid, range_header, bytes(body) if isinstance(body, bytearray) else body, identity
+
+    def _ttl(self, url):
+        matches = [prefix for prefix in self.ttls if url.startswith(prefix)]
+        return self.ttls[max(matches, key=len)] if matches else self.ttl
+
+    def lookup(self, key):
+        """
+        returns (response, conditional headers), response is only set on a fresh hit, conditional headers are set
+        when a stale entry can be revalidated
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None, None
+            self._entries.move_to_end(key)
+            if entry.expires > time.time():
+                self.hits += 1
+                return entry.response, None
+            self.misses += 1
+            if entry.validators:
+                return None, entry.validators
+            del self._entries[key]
+            return None, None
+
+    def revalidated(self, key):
+        """
+        renews a stale entry after a 304 response and returns its cached response
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self.revalidations += 1
+            self._entries[key] = entry._replace(expires=time.time() + self._ttl(key[0]))
+            return entry.response
+
+    def store(self, key, response):
+        """
+        caches a successful response unless the API marks it no-store
+        """
+        if response.status_code != 200 or 'no-store' in response.headers.get('Cache-Control', ''):
+            return
+        validators = {}
+        if response.headers.get('ETag'):
+            validators['If-None-Match'] = response.headers['ETag']
+        if response.headers.get('Last-Modified'):
+            validators['If-Modified-Since'] = response.headers['Last-Modified']
+        with self._lock:
+            self._entries[key] = _CacheEntry(response, time.time() + self._ttl(key[0]), validators)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        returns hit, miss, revalidation and eviction counters and the current number of entries
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'revalidations': self.revalidations,
+                    'evictions': self.evictions, 'size': len(self._entries)}
@@ -0,0 +1,254 @@
+#!/bin/python3
+import time
+import random
+import logging
+import threading
+import email.utils
+import requests
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """
+    raised instead of sending a request to a domain whose circuit breaker is open
+    """
+
+
+class TokenBucket:
+    """
+    Thread safe token bucket, allows rate requests per second with bursts of up to burst requests.
+    The rate is halved when the API throttles and recovers gradually as requests succeed
+    """
+
+    def __init__(self, rate, burst=None):
+        if not isinstance(rate, (int, float)) or rate <= 0:
+            logger.critical('rate must be a positive number of requests per second, the following was provided: %s' % rate)
+            raise ValueError('rate must be a positive number of requests per second, the following was provided: %s' % rate)
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst or max(1, rate)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        takes a token, sleeping until one is available. Tokens are reserved in order so waiters are served fairly
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    def throttle(self):
+        with self._lock:
+            self.rate = max(self.max_rate / 16, self.rate / 2)
+
+    def recover(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive failures, rejecting requests for reset_timeout seconds before letting a
+    single trial request through, which closes the circuit again if it succeeds
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self._opened is None:
+            return 'closed'
+        return 'half-open' if time.monotonic() - self._opened >= self.reset_timeout else 'open'
+
+    def allow(self):
+        # closed circuits skip the lock, a stale read at worst lets through a request racing the circuit opening
+        if self._opened is None:
+            return True
+        with self._lock:
+            if self._opened is None:
+                return True
+            if time.monotonic() - self._opened >= self.reset_timeout and not self._trial:
+                self._trial = True
+                return True
+            return False
+
+    def record_success(self):
+        if self._opened is None and not self._failures:
+            return
+        with self._lock:
+            self._failures = 0
+            self._opened = None
+            self._trial = False
+
+    def release(self):
+        """
+        gives up a claimed trial request that ended without an outcome, so the next request becomes the trial
+        """
+        if self._opened is None:
+            return
+        with self._lock:
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial or self._failures >= self.failure_threshold:
+                self._opened = time.monotonic()
+                self._trial = False
+
+
+class RequestScheduler:
+    """
+    Paces and retries requests per domain. Requests wait on a per domain token bucket when a rate is configured,
+    429 responses are retried for any method and 5xx responses and connection errors for idempotent methods, after
+    the Retry-After delay or a jittered exponential backoff. A 429 also holds back every request to its domain until
+    the delay has passed. Consecutive failed requests, counted once their retries are used up, open a per domain
+    circuit breaker, failure_threshold=None disables it
+    """
+
+    idempotent_methods = ('GET', 'PUT')
+    retry_statuses = (500, 502, 503, 504)
+
+    def __init__(self, rate=None, burst=None, rates=None, max_retries=3, backoff=0.5, max_backoff=30,
+                 failure_threshold=5, reset_timeout=30):
+        if not isinstance(max_retries, int) or max_retries < 0:
+            logger.critical('max_retries must be an integer of 0 or more, the following was provided: %s' % max_retries)
+            raise ValueError('max_retries must be an integer of 0 or more, the following was provided: %s' % max_retries)
+        self.rate = rate
+        self.burst = burst
+        self.rates = dict(rates or {})
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._buckets = {}
+        self._breakers = {}
+        self._held_until = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, domain):
+        rate = self.rates.get(domain, self.rate)
+        if rate is None:
+            return None
+        bucket = self._buckets.get(domain)
+        if bucket is not None:
+            return bucket
+        with self._lock:
+            if domain not in self._buckets:
+                self._buckets[domain] = TokenBucket(rate, self.burst)
+            return self._buckets[domain]
+
+    def breaker(self, domain):
+        if self.failure_threshold is None:
+            return None
+        breaker = self._breakers.get(domain)
+        if breaker is not None:
+            return breaker
+        with self._lock:
+            if domain not in self._breakers:
+                self._breakers[domain] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+            return self._breakers[domain]
+
+    def before_request(self, domain):
+        """
+        blocks until a request to domain may be sent, raises CircuitOpenError if its circuit is open
+        """
+        wait = self._held_until.get(domain, 0) - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        bucket = self._bucket(domain)
+        if bucket is not None:
+            bucket.acquire()
+        # checked last so a half open circuit's trial isn't claimed by a request that is still waiting
+        breaker = self.breaker(domain)
+        if breaker is not None and not breaker.allow():
+            logger.critical('Circuit open for domain: %s, not sending request' % domain)
+            raise CircuitOpenError('Circuit open for domain: %s, not sending request' % domain)
+
+    def record(self, domain, response=None, retrying=False):
+        """
+        records the outcome of a request, response is None for connection errors. A failed attempt that is about to be
+        retried isn't counted by the circuit breaker, so each request counts as one failure once its retries are used up
+        """
+        breaker = self.breaker(domain)
+        bucket = self._bucket(domain)
+        if response is None or response.status_code in self.retry_statuses:
+            if breaker is not None and retrying:
+                breaker.release()
+            elif breaker is not None:
+                breaker.record_failure()
+        elif response.status_code == 429:
+            if breaker is not None:
+                breaker.release()
+            if bucket is not None:
+                bucket.throttle()
+        else:
+            if breaker is not None:
+                breaker.record_success()
+            if bucket is not None:
+                bucket.recover()
+
+    def release(self, domain):
+        """
+        releases a request let through by before_request that failed before it could be recorded
+        """
+        breaker = self.breaker(domain)
+        if breaker is not None:
+            breaker.release()
+
+    def retry_delay(self, domain, method, attempt, response=None):
+        """
+        returns the seconds to wait before retrying, or None if the request shouldn't be retried
+        """
+        if attempt >= self.max_retries:
+            return None
+        if response is not None and response.status_code == 429:
+            delay = self._retry_after(response)
+            if delay is None:
+                delay = self._backoff(attempt)
+            self._held_until[domain] = max(self._held_until.get(domain, 0), time.monotonic() + delay)
+            return delay
+        if method in self.idempotent_methods and (response is None or response.status_code in self.retry_statuses):
+            delay = self._retry_after(response) if response is not None else None
+            return self._backoff(attempt) if delay is None else delay
+        return None
+
+    def _backoff(self, attempt):
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def _retry_after(self, response):
+        """
+        parses a Retry-After header given as seconds or as an http date, capped at max_backoff so one response can't
+        hold back the caller and its domain indefinitely
+        """
+        retry_after = response.headers.get('Retry-After')
+        if not retry_after:
+            return None
+        try:
+            delay = max(0, float(retry_after))
+        except ValueError:
+            try:
+                delay = max(0, email.utils.parsedate_to_datetime(retry_after).timestamp() - time.time())
+            except (TypeError, ValueError):
+                logger.warning('Unable to parse Retry-After header: %s' % retry_after)
+                return None
+        if delay > self.max_backoff:
+            logger.warning('Retry-After of %.0f seconds capped at max_backoff of %s seconds' % (delay, self.max_backoff))
+            return self.max_backoff
+        return delay
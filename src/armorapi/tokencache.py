@@ -0,0 +1,98 @@
+#!/bin/python3
+import os
+import json
+import logging
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class TokenCache:
+    """
+    Interface for authorisation token caches, subclass and implement get, set and delete to plug in another store.
+    Entries are dicts holding the token, token prefix, the account IDs returned by /me (the first being the default
+    account) and issue/expiry times
+    """
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, entry):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+
+class MemoryTokenCache(TokenCache):
+    """
+    In process token cache, shares tokens between api objects created by the same process
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            return self._entries.get(key)
+
+    def set(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class FileTokenCache(TokenCache):
+    """
+    File backed token cache, lets short lived processes reuse a still valid token instead of authenticating.
+    The file is only readable by the current user and is replaced atomically on every write
+    """
+
+    def __init__(self, path=None):
+        if path is None:
+            path = os.path.join(os.path.expanduser('~'), '.cache', 'armorapi', 'tokens.json')
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _read(self):
+        try:
+            with open(self.path) as cache_file:
+                return json.load(cache_file)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as error:
+            logger.warning('Unable to read token cache %s, ignoring it: %s' % (self.path, error))
+            return {}
+
+    def _write(self, entries):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tokens-')
+        try:
+            with os.fdopen(fd, 'w') as cache_file:
+                json.dump(entries, cache_file)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def get(self, key):
+        with self._lock:
+            return self._read().get(key)
+
+    def set(self, key, entry):
+        with self._lock:
+            entries = self._read()
+            entries[key] = entry
+            self._write(entries)
+
+    def delete(self, key):
+        with self._lock:
+            entries = self._read()
+            if entries.pop(key, None) is not None:
+                self._write(entries)
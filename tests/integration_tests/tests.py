@@ -1,5 +1,5 @@
 #!/bin/python3
-import os, logging, sys
+import os, logging, sys, asyncio, time, gzip, json, tempfile
 sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../../src")
 from armorapi import *
 
@@ -60,14 +60,20 @@ def test_explicit_v2_auth_invocation():
 def test_401_timer():
     print('\n----------------- TEST START --------------------\n')
     print('*** TESTING 401 TIMER :\n')
-    armorapi = ArmorApi(username, password, retries401=2)
-    assert armorapi._count401 == 2, 'initial 401 count doesn\'t match retries401 provided'
+    armorapi = ArmorApi(username, password, retries401=1)
+    assert armorapi._count401 == 1, 'initial 401 count doesn\'t match retries401 provided'
+    armorapi._authorisation_token = 'NOTAVALIDTOKEN'
+    armorapi._new_token = True
+    armorapi._test_request_and_accountid()
+    assert armorapi._count401 == 0, '401 count not decremented by reauthentication, value is: %s' % armorapi._count401
     armorapi._authorisation_token = 'NOTAVALIDTOKEN'
     armorapi._new_token = True
     try:
         armorapi._test_request_and_accountid()
+        print('\n********************* TEST FAILED **************************\n')
     except requests.exceptions.HTTPError:
-        assert armorapi._count401 < 0, '401 count has decremented below 0 before exception, value is: %s' % armorapi.count401
+        assert armorapi._count401 < 0, '401 count has not been exhausted before exception, value is: %s' % armorapi._count401
+        print('\n********************* TEST PASS ****************************\n')
 
     print('\n----------------- TEST COMPLETE -----------------\n')
 
@@ -82,6 +88,48 @@ def test_retries401_sanitisation():
 
     print('\n----------------- TEST COMPLETE -----------------\n')
 
+def test_adfs_parser_sanitisation():
+    print('\n----------------- TEST START --------------------\n')
+    print('*** TESTING ADFS PARSER SANITISATION :\n')
+    try:
+        armorapi = ArmorApi(username, password, auth=2, adfs_parser='lxml')
+        print('\n********************* TEST FAILED **************************\n')
+    except ValueError:
+        print('\n********************* TEST PASS ****************************\n')
+
+    print('\n----------------- TEST COMPLETE -----------------\n')
+
+def test_adfs_input_value():
+    print('\n----------------- TEST START --------------------\n')
+    print('*** TESTING ADFS LOGIN PAGE INPUT EXTRACTION :\n')
+
+    from armorapi.adfs import input_value
+    login_page = ('<html><body><form method="post" action="/adfs/ls/?client-request-id=1&amp;wa=wsignin1.0">'
+                  '<input type="hidden" name="AuthMethod" value="FormsAuthentication">'
+                  '<input id="context" type="hidden" name="Context" value="ctx&amp;1&#43;2">'
+                  '</form></body></html>')
+    assert input_value(login_page, {'id': 'context'}) == 'ctx&1+2', 'context input value not found or not unescaped'
+    assert input_value(login_page) == 'FormsAuthentication', 'first input value not found'
+    for parser in ('html.parser', 'bs4', lambda html, attrs: 'custom'):
+        value = input_value(login_page, {'id': 'context'}, parser)
+        assert value == ('custom' if callable(parser) else 'ctx&1+2'), '%s parser returned: %s' % (parser, value)
+
+    # class is multi valued, only BeautifulSoup matches one class of several, so this is found by the auto fallback
+    fallback_page = '<form><input class="context field" type="hidden" value="fallback"></form>'
+    assert input_value(fallback_page, {'class': 'context'}) == 'fallback', 'auto parser did not fall back to bs4'
+    try:
+        input_value(fallback_page, {'class': 'context'}, 'html.parser')
+        print('\n********************* TEST FAILED **************************\n')
+    except ValueError:
+        print('\n********************* TEST PASS ****************************\n')
+    try:
+        input_value(login_page, {'id': 'missing'})
+        print('\n********************* TEST FAILED **************************\n')
+    except ValueError:
+        print('\n********************* TEST PASS ****************************\n')
+
+    print('\n----------------- TEST COMPLETE -----------------\n')
+
 def test_v1_token_reissue():
     print('\n----------------- TEST START --------------------\n')
     print('*** TESTING v1 AUTH TOKEN REISSUE :\n')
@@ -95,6 +143,236 @@ def test_v1_token_reissue():
 
     print('\n----------------- TEST COMPLETE -----------------\n')
 
+def test_background_token_renewal():
+    print('\n----------------- TEST START --------------------\n')
+    print('*** TESTING BACKGROUND TOKEN RENEWAL :\n')
+
+    armorapi = ArmorApi(username, password, auth=1, renew_interval=5)
+    auth_token = armorapi.session.headers['Authorization']
+    time.sleep(10)
+    armorapi.stop_token_renewal()
+    assert auth_token != armorapi.session.headers['Authorization'], 'Auth token has not been renewed in the background'
+    armorapi._test_request_and_accountid()
+
+    print('\n----------------- TEST COMPLETE -----------------\n')
+
+def test_token_cache():
+    print('\n----------------- TEST START --------------------\n')
+    print('*** TESTING STARTUP FROM THE TOKEN CACHE :\n')
+
+    with tempfile.TemporaryDirectory() as directory:
+        for token_cache in (MemoryTokenCache(), FileTokenCache(os.path.join(directory, 'tokens.json'))):
+            armorapi = ArmorApi(username, password, token_cache=token_cache)
+            cached_armorapi = ArmorApi(username, password, token_cache=token_cache)
+            assert cached_armorapi.session.headers['Authorization'] == armorapi.session.headers['Authorization'], 'cached token not used'
+            assert cached_armorapi.make_request('https://api.armor.com/me').status_code == 200, 'cached token rejected'
+            try:
+                ArmorApi(username, password + 'x', token_cache=token_cache)
+                print('\n********************* TEST FAILED **************************\n')
+            except requests.exceptions.HTTPError:
+                print('\n********************* TEST PASS ****************************\n')
+
+    print('\n----------------- TEST COMPLETE -----------------\n')
+
+def test_iter_items():
+    print('\n----------------- TEST START --------------------\n')
+    print('*** TESTING PAGED ITEM ITERATION :\n')
+
+    armorapi = ArmorApi(username, password)
+    url = 'https://api.armor.com/vms'
+    items = list(armorapi.iter_items(url, page_size=2))
+    prefetched_items = list(armorapi.iter_items(url, page_size=2, prefetch=2))
+    assert items == prefetched_items, 'prefetched pages differ from sequential pages'
+    assert items == armorapi.make_request(url).json(), 'paged items differ from unpaged request'
+
+    print('\n----------------- TEST COMPLETE -----------------\n')
+
+def test_export():
+    print('\n----------------- TEST START --------------------\n')
+    print('*** TESTING EXPORT TO COMPRESSED NDJSON :\n')
+
+    armorapi = ArmorApi(username, password)
+    url = 'https://api.armor.com/vms'
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'vms.ndjson.gz')
+        count = armorapi.export(url, path, page_size=2, compression='gzip')
+        with gzip.open(path, 'rt') as export_file:
+            items = [json.loads(line) for line in export_file]
+        assert not os.path.exists(path + '.checkpoint'), 'checkpoint not removed after export completed'
+    assert count == len(items), 'export count differs from items written'
+    assert items == armorapi.make_request(url).json(), 'exported items differ from unpaged request'
+
+    print('\n----------------- TEST COMPLETE -----------------\n')
+
+def test_stream_records():
+    print('\n----------------- TEST START --------------------\n')
+    print('*** TESTING STREAMED RECORD DECODING :\n')
+
+    armorapi = ArmorApi(username, password)
+    url = 'https://api.armor.com/vms'
+    assert list(armorapi.stream_records(url)) == armorapi.make_request(url).json(), 'streamed records differ from unstreamed request'
+    assert list(armorapi.stream_records(url, chunk_size=7)) == armorapi.make_request(url).json(), 'streamed records differ with small chunks'
+
+    print('\n----------------- TEST COMPLETE -----------------\n')
+
+def test_json_stream_chunk_boundaries():
+    print('\n----------------- TEST START --------------------\n')
+    print('*** TESTING JSON STREAM DECODING ACROSS CHUNK BOUNDARIES :\n')
+
+    records = [1.5, -2e-3, 12345, {'a': [0.25, 'x,]'], 'b': None}, 'str', True, [], 6.02E23]
+    for document, items_key in ((json.dumps(records), None), (json.dumps({'other': 1, 'items': records}), 'items'),
+                                ('\n'.join(json.dumps(record) for record in records[1:]), None)):
+        expected = records if document.startswith(('[', '{')) else records[1:]
+        encoded = document.encode()
+        for size in range(1, 8):
+            chunks = [encoded[index:index + size] for index in range(0, len(encoded), size)]
+            assert list(iter_json_records(chunks, items_key)) == expected, 'records differ with %s byte chunks' % size
+
+    print('\n----------------- TEST COMPLETE -----------------\n')
+
+def scheduler_response(status_code, retry_after=None):
+    response = requests.Response()
+    response.status_code = status_code
+    if retry_after is not None:
+        response.headers['Retry-After'] = retry_after
+    return response
+
+def test_request_scheduler():
+    print('\n----------------- TEST START --------------------\n')
+    print('*** TESTING REQUEST SCHEDULER :\n')
+
+    bucket = TokenBucket(rate=100, burst=2)
+    assert bucket.acquire() == 0 and bucket.acquire() == 0, 'burst tokens were not available immediately'
+    assert bucket.acquire() > 0, 'token taken beyond the burst without waiting'
+    bucket.throttle()
+    assert bucket.rate == 50, 'throttled rate was not halved, value is: %s' % bucket.rate
+    bucket.recover()
+    assert bucket.rate == 55, 'throttled rate did not recover, value is: %s' % bucket.rate
+
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+    breaker.record_failure()
+    assert breaker.state == 'closed' and breaker.allow(), 'circuit opened before failure_threshold'
+    breaker.record_failure()
+    assert breaker.state == 'open' and not breaker.allow(), 'circuit did not open at failure_threshold'
+    time.sleep(0.06)
+    assert breaker.state == 'half-open', 'circuit not half open after reset_timeout'
+    assert breaker.allow() and not breaker.allow(), 'half open circuit did not let through exactly one trial'
+    breaker.record_failure()
+    assert breaker.state == 'open', 'failed trial did not reopen the circuit'
+    time.sleep(0.06)
+    assert breaker.allow(), 'trial not let through after reset_timeout'
+    breaker.record_success()
+    assert breaker.state == 'closed' and breaker.allow(), 'successful trial did not close the circuit'
+
+    scheduler = RequestScheduler(failure_threshold=1, reset_timeout=0.05)
+    for outcome in (scheduler_response(429), None):
+        scheduler.record('trial.armor.com')
+        time.sleep(0.06)
+        scheduler.before_request('trial.armor.com')
+        if outcome is None:
+            scheduler.release('trial.armor.com')
+        else:
+            scheduler.record('trial.armor.com', outcome)
+        assert scheduler.breaker('trial.armor.com').allow(), 'trial not released after %s' % ('an exception' if outcome is None else 'a 429')
+        scheduler.record('trial.armor.com', scheduler_response(200))
+
+    scheduler = RequestScheduler(max_retries=2, failure_threshold=3)
+    for attempt in range(3):
+        response = scheduler_response(503)
+        scheduler.record('retry.armor.com', response, retrying=scheduler.retry_delay('retry.armor.com', 'GET', attempt, response) is not None)
+    assert scheduler.breaker('retry.armor.com')._failures == 1, 'retried attempts counted as separate failures'
+
+    scheduler = RequestScheduler(max_backoff=5)
+    assert scheduler.retry_delay('seconds.armor.com', 'GET', 0, scheduler_response(503, '2')) == 2, 'Retry-After seconds ignored'
+    http_date = time.strftime('%a, %d %b %Y %H:%M:%S GMT', time.gmtime(time.time() + 4))
+    delay = scheduler.retry_delay('date.armor.com', 'GET', 0, scheduler_response(503, http_date))
+    assert 2 < delay <= 4, 'Retry-After http date ignored, delay is: %s' % delay
+    assert scheduler.retry_delay('cap.armor.com', 'GET', 0, scheduler_response(429, '3600')) == 5, 'Retry-After not capped at max_backoff'
+    assert scheduler.retry_delay('post.armor.com', 'POST', 0, scheduler_response(503)) is None, 'POST retried after a server error'
+    assert scheduler.retry_delay('post.armor.com', 'POST', 0, scheduler_response(429, '0')) == 0, 'throttled POST not retried'
+
+    print('\n----------------- TEST COMPLETE -----------------\n')
+
+def test_metrics():
+    print('\n----------------- TEST START --------------------\n')
+    print('*** TESTING INSTRUMENTATION AND PROMETHEUS METRICS :\n')
+
+    collector = MetricsCollector(buckets=(0.1, 1))
+    instrumentation = Instrumentation(collectors=[collector])
+    events = []
+    instrumentation.add_pre_request_hook(lambda method, url, headers: headers.update({'X-Request-Id': 'id'}))
+    instrumentation.add_post_request_hook(events.append)
+    headers = {}
+    instrumentation.pre_request('GET', 'https://api.armor.com/vms/1234', headers)
+    assert headers == {'X-Request-Id': 'id'}, 'pre request hook could not add headers'
+
+    endpoint = endpoint_label('https://api.armor.com/vms/1234?page=2')
+    assert endpoint == 'api.armor.com/vms/{id}', 'endpoint label not normalised, value is: %s' % endpoint
+    for elapsed, status in ((0.05, 200), (0.5, 200), (5, 503)):
+        instrumentation.post_request(RequestEvent('GET', endpoint, endpoint, status, elapsed, 10, 100, 0, None, None))
+    instrumentation.post_request(RequestEvent('GET', 'a"b\\c', 'a"b\\c', None, 0.01, 0, 0, 1, ConnectionError(), None))
+    instrumentation.retry('api.armor.com', 503)
+    instrumentation.reauthentication(False)
+    with instrumentation.timed_stage('v1 token'):
+        pass
+    assert len(events) == 4, 'post request hook not called for every event'
+
+    lines = collector.to_prometheus().splitlines()
+    labels = '{method="GET",endpoint="api.armor.com/vms/{id}"'
+    for line in ('# TYPE armorapi_request_duration_seconds histogram',
+                 'armorapi_request_duration_seconds_bucket%s,le="0.1"} 1' % labels,
+                 'armorapi_request_duration_seconds_bucket%s,le="1"} 2' % labels,
+                 'armorapi_request_duration_seconds_bucket%s,le="+Inf"} 3' % labels,
+                 'armorapi_request_duration_seconds_sum%s} 5.55' % labels,
+                 'armorapi_request_duration_seconds_count%s} 3' % labels,
+                 '# TYPE armorapi_request_bytes_total counter',
+                 'armorapi_request_bytes_total%s} 30' % labels,
+                 'armorapi_response_bytes_total%s} 300' % labels,
+                 'armorapi_responses_total%s,status="503"} 1' % labels,
+                 'armorapi_request_errors_total{method="GET",endpoint="a\\"b\\\\c",error="ConnectionError"} 1',
+                 'armorapi_retries_total{domain="api.armor.com",reason="503"} 1',
+                 'armorapi_reauthentications_total{result="denied"} 1',
+                 'armorapi_auth_stage_duration_seconds_count{stage="v1 token"} 1'):
+        assert line in lines, 'prometheus output is missing: %s' % line
+
+    print('\n----------------- TEST COMPLETE -----------------\n')
+
+def test_make_requests():
+    print('\n----------------- TEST START --------------------\n')
+    print('*** TESTING BATCH REQUESTS :\n')
+
+    armorapi = ArmorApi(username, password)
+    results = armorapi.make_requests(['https://api.armor.com/me'] * 4 + ['https://google.com'], domain_limits={'api.armor.com': 2})
+    assert all(result.response.status_code == 200 for result in results[:4]), 'batch requests failed'
+    assert isinstance(results[4].error, ValueError), 'non whitelisted batch request did not fail'
+
+    print('\n----------------- TEST COMPLETE -----------------\n')
+
+def test_response_cache():
+    print('\n----------------- TEST START --------------------\n')
+    print('*** TESTING RESPONSE CACHE :\n')
+
+    cache = ResponseCache(ttl=60)
+    armorapi = ArmorApi(username, password, response_cache=cache)
+    response = armorapi.make_request('https://api.armor.com/me')
+    assert armorapi.make_request('https://api.armor.com/me') is response, 'cached response not returned'
+    assert cache.stats()['hits'] == 1, 'cache hit not counted'
+
+    print('\n----------------- TEST COMPLETE -----------------\n')
+
+def test_account_views():
+    print('\n----------------- TEST START --------------------\n')
+    print('*** TESTING ACCOUNT VIEWS :\n')
+
+    armorapi = ArmorApi(username, password)
+    session_accountid = armorapi.session.headers['X-Account-Context']
+    for view in armorapi.for_accounts():
+        response = view.make_request('https://api.armor.com/me')
+        assert response.request.headers['X-Account-Context'] == str(view.accountid), 'account view header not sent'
+    assert armorapi.session.headers['X-Account-Context'] == session_accountid, 'account view changed session header'
+
+    print('\n----------------- TEST COMPLETE -----------------\n')
+
 def test_make_request_sanitisation():
     print('\n----------------- TEST START --------------------\n')
     print('*** TESTING MAKE REQUEST SANITISATION :\n')
@@ -107,6 +385,19 @@ def test_make_request_sanitisation():
 
     print('\n----------------- TEST COMPLETE -----------------\n')
 
+def test_async_invocation():
+    print('\n----------------- TEST START --------------------\n')
+    print('*** TESTING ASYNC INVOCATION AND CONCURRENT REQUESTS :\n')
+
+    async def run():
+        async with AsyncArmorApi(username, password) as armorapi:
+            responses = await asyncio.gather(*[armorapi.make_request('https://api.armor.com/me') for _ in range(5)])
+            assert all(response.status == 200 for response in responses), 'not all concurrent requests succeeded'
+
+    asyncio.run(run())
+
+    print('\n----------------- TEST COMPLETE -----------------\n')
+
 if __name__ == '__main__':
     handler = logging.StreamHandler()
     handler.setLevel(logging.DEBUG)
@@ -120,6 +411,20 @@ if __name__ == '__main__':
     test_explicit_v2_auth_invocation()
     test_401_timer()
     test_v1_token_reissue()
+    test_background_token_renewal()
+    test_token_cache()
     test_retries401_sanitisation()
+    test_adfs_parser_sanitisation()
+    test_adfs_input_value()
+    test_iter_items()
+    test_stream_records()
+    test_json_stream_chunk_boundaries()
+    test_request_scheduler()
+    test_metrics()
+    test_export()
+    test_make_requests()
+    test_response_cache()
+    test_account_views()
     test_make_request_sanitisation()
     test_accountid_sanitisation()
+    test_async_invocation()